@@ -0,0 +1,346 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from models import get_db, DB_PATH
+
+# Балансы аккаунтов живут в памяти: списание и зачисление - атомарно под одной блокировкой.
+# Каждое изменение сначала дописывается в журнал (append-only, JSON lines), затем применяется;
+# в таблицу accounts балансы переносятся пачками. После сбоя балансы восстанавливаются
+# из журнала: записи новее контрольной точки в БД применяются повторно.
+# Ставка и выигрыш раунда пишутся в журнал с id раунда (ref) до коммита транзакции раунда.
+# При восстановлении ставка применяется, только если раунд есть в БД, а выигрыш - только если
+# раунд в БД завершен и еще не оплачен (round_results.credited). Пока транзакция раунда
+# не закоммичена или не отменена (round_transaction), балансы в БД не переносятся
+
+LEDGER_JOURNAL_PATH = os.environ.get(
+    'LEDGER_JOURNAL_PATH', os.path.join(os.path.dirname(DB_PATH), 'ledger.journal')
+)
+# Как часто переносить балансы в SQLite (секунды)
+LEDGER_FLUSH_INTERVAL = float(os.environ.get('LEDGER_FLUSH_INTERVAL', '1'))
+# fsync после каждой записи журнала: переживает и сбой ОС, но каждая операция ждет диск
+LEDGER_FSYNC = os.environ.get('LEDGER_FSYNC', '0') == '1'
+# Сколько секунд перенос в БД ждет завершения открытых транзакций раундов (потом - следующая попытка)
+LEDGER_ROUND_WAIT = 5.0
+
+class LedgerError(Exception):
+    """Базовая ошибка журнала баланса"""
+
+class AccountNotFound(LedgerError):
+    pass
+
+class InsufficientFunds(LedgerError):
+    pass
+
+# Записи ставки и выигрыша раунда и их отмены (если коммит транзакции раунда не прошел)
+ROUND_STAKE_REASONS = ('round_stake', 'round_stake_refund')
+ROUND_WIN_REASONS = ('round_win', 'round_win_revert')
+
+# account_id -> {'id', 'user_id', 'account_type', 'balance'}
+_accounts = {}
+# (user_id, account_type) -> account_id
+_by_user_type = {}
+_dirty = set()
+_seq = 0
+_flushed_seq = 0
+_journal = None
+# (seq, round_id) выигрышей, еще не отмеченных в round_results.credited
+_win_refs = []
+_lock = threading.Lock()
+# Переносы в БД (периодический, atexit, при загрузке) идут строго по одному: иначе более
+# старый снимок балансов мог бы закоммититься после нового и откатить контрольную точку
+_flush_lock = threading.Lock()
+# Транзакции раундов между записью в журнал и коммитом (или отменой) в БД
+_open_rounds = 0
+_rounds_closed = threading.Condition(_lock)
+
+def _read_journal():
+    """Записи журнала (оборванная при сбое последняя строка пропускается)"""
+    if not os.path.exists(LEDGER_JOURNAL_PATH):
+        return []
+    entries = []
+    with open(LEDGER_JOURNAL_PATH, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+    return entries
+
+def _index(account):
+    _accounts[account['id']] = account
+    _by_user_type[(account['user_id'], account['account_type'])] = account['id']
+
+def _load_accounts(cursor, user_id=None):
+    if user_id is None:
+        cursor.execute('SELECT id, user_id, account_type, balance FROM accounts')
+    else:
+        cursor.execute('SELECT id, user_id, account_type, balance FROM accounts WHERE user_id = ?', (user_id,))
+    for row in cursor.fetchall():
+        if row[0] not in _accounts:
+            _index({'id': row[0], 'user_id': row[1], 'account_type': row[2], 'balance': row[3] or 0.0})
+
+def _round_states(cursor, round_ids):
+    """round_id -> (status, credited) для раундов из записей журнала"""
+    states = {}
+    round_ids = list(round_ids)
+    for i in range(0, len(round_ids), 500):
+        chunk = round_ids[i:i + 500]
+        cursor.execute(f'''
+            SELECT r.id, r.status, rr.credited
+            FROM rounds r
+            LEFT JOIN round_results rr ON rr.round_id = r.id
+            WHERE r.id IN ({",".join("?" * len(chunk))})
+        ''', chunk)
+        states.update((row[0], (row[1], row[2])) for row in cursor.fetchall())
+    return states
+
+def _replayable(entry, rounds):
+    """Применять ли запись при восстановлении.
+
+    Ставка - только если коммит создания раунда прошел (раунд есть в БД). Выигрыш - только
+    если коммит завершения прошел (раунд завершен) и выигрыш еще не перенесен в accounts
+    вместе с контрольной точкой.
+    """
+    if entry.get('reason') in ROUND_STAKE_REASONS and entry.get('ref') is not None:
+        return entry['ref'] in rounds
+    if entry.get('reason') in ROUND_WIN_REASONS:
+        state = rounds.get(entry.get('ref'))
+        return state is not None and state[0] == 'finished' and not state[1]
+    return True
+
+def load_ledger():
+    """Загрузить балансы из БД, доиграть журнал после контрольной точки и доплатить
+    выигрыши завершенных раундов, которых нет в журнале (при старте)"""
+    global _seq, _flushed_seq, _journal
+    conn = get_db()
+    cursor = conn.cursor()
+    with _flush_lock, _lock:
+        _accounts.clear()
+        _by_user_type.clear()
+        _dirty.clear()
+        del _win_refs[:]
+        _load_accounts(cursor)
+        cursor.execute('SELECT seq FROM ledger_checkpoint WHERE id = 1')
+        row = cursor.fetchone()
+        _flushed_seq = row[0] if row else 0
+        _seq = _flushed_seq
+
+        entries = [entry for entry in _read_journal() if entry['seq'] > _flushed_seq]
+        rounds = _round_states(cursor, {
+            entry['ref'] for entry in entries
+            if entry.get('reason') in ROUND_STAKE_REASONS + ROUND_WIN_REASONS and entry.get('ref') is not None
+        })
+
+        # Балансы в БД соответствуют контрольной точке, поэтому записи после нее
+        # применяются изменениями (delta) ровно один раз
+        recovered = 0
+        paid = {}
+        for entry in entries:
+            _seq = max(_seq, entry['seq'])
+            account = _accounts.get(entry['account_id'])
+            if account is None or not _replayable(entry, rounds):
+                continue
+            account['balance'] += entry['delta']
+            _dirty.add(account['id'])
+            recovered += 1
+            if entry.get('reason') == 'round_win':
+                paid[entry['ref']] = paid.get(entry['ref'], 0) + 1
+                _win_refs.append((entry['seq'], entry['ref']))
+            elif entry.get('reason') == 'round_win_revert':
+                paid[entry['ref']] = paid.get(entry['ref'], 0) - 1
+
+        # Раунд завершен в БД, а выигрыш не оплачен ни в accounts, ни в журнале
+        # (сбой между коммитом и записью журнала) - зачисляем сейчас
+        cursor.execute('''
+            SELECT rr.round_id, r.account_id, r.amount, rr.profit
+            FROM round_results rr
+            JOIN rounds r ON r.id = rr.round_id
+            WHERE rr.win AND rr.credited = 0
+        ''')
+        reconciled = 0
+        for round_id, account_id, amount, profit in cursor.fetchall():
+            account = _accounts.get(account_id)
+            if account is None or paid.get(round_id, 0) > 0:
+                continue
+            _append(account, amount + profit, 'round_win', round_id)
+            reconciled += 1
+    conn.close()
+
+    if recovered:
+        print(f'♻️ [account_ledger] Recovered {recovered} balance change(s) from journal')
+    if reconciled:
+        print(f'♻️ [account_ledger] Credited {reconciled} unpaid round win(s)')
+    flush()
+    with _lock:
+        if _journal is None:
+            _journal = open(LEDGER_JOURNAL_PATH, 'a', encoding='utf-8')
+    return len(_accounts)
+
+def _append(account, delta, reason, ref):
+    """Записать изменение в журнал и применить его (вызывается под _lock)"""
+    global _seq, _journal
+    if _journal is None:
+        _journal = open(LEDGER_JOURNAL_PATH, 'a', encoding='utf-8')
+    balance = account['balance'] + delta
+    _seq += 1
+    _journal.write(json.dumps({
+        'seq': _seq, 'ts': time.time(), 'account_id': account['id'],
+        'delta': delta, 'balance': balance, 'reason': reason, 'ref': ref
+    }) + '\n')
+    _journal.flush()
+    if LEDGER_FSYNC:
+        os.fsync(_journal.fileno())
+    account['balance'] = balance
+    _dirty.add(account['id'])
+    if reason == 'round_win' and ref is not None:
+        _win_refs.append((_seq, ref))
+    return balance
+
+def _get(account_id):
+    account = _accounts.get(account_id)
+    if account is None:
+        raise AccountNotFound(f'Account {account_id} not found')
+    return account
+
+def find_account(user_id, account_id=None, account_type='demo'):
+    """Аккаунт пользователя по id или по типу (копия) или None"""
+    try:
+        user_id = int(user_id)
+        account_id = int(account_id) if account_id else None
+    except (ValueError, TypeError):
+        return None
+    if account_id:
+        account = _accounts.get(account_id)
+        if account is None or account['user_id'] != user_id:
+            return None
+    else:
+        account = _accounts.get(_by_user_type.get((user_id, account_type)))
+        if account is None:
+            return None
+    return dict(account)
+
+def get_user_accounts(user_id, create=True):
+    """Аккаунты пользователя в порядке id (create - создать demo и real, если их еще нет)"""
+    accounts = [dict(a) for a in _accounts.values() if a['user_id'] == user_id]
+    if accounts or not create:
+        return sorted(accounts, key=lambda a: a['id'])
+
+    from models import get_or_create_accounts
+    get_or_create_accounts(user_id)
+    conn = get_db()
+    with _lock:
+        _load_accounts(conn.cursor(), user_id)
+    conn.close()
+    return sorted((dict(a) for a in _accounts.values() if a['user_id'] == user_id), key=lambda a: a['id'])
+
+def get_balance(account_id):
+    """Текущий баланс аккаунта"""
+    return _get(account_id)['balance']
+
+def debit(account_id, amount, reason, ref=None):
+    """Списать сумму, если ее хватает (проверка и списание атомарны); возвращает новый баланс"""
+    with _lock:
+        account = _get(account_id)
+        if account['balance'] < amount:
+            raise InsufficientFunds(f'Insufficient balance on account {account_id}')
+        return _append(account, -amount, reason, ref)
+
+def credit(account_id, amount, reason, ref=None):
+    """Зачислить сумму; возвращает новый баланс"""
+    with _lock:
+        return _append(_get(account_id), amount, reason, ref)
+
+def credit_many(credits, reason):
+    """Зачислить [(account_id, сумма, ref)] разом (все или ничего); возвращает {account_id: новый баланс}"""
+    with _lock:
+        accounts = {account_id: _get(account_id) for account_id, _, _ in credits}
+        balances = {}
+        for account_id, amount, ref in credits:
+            balances[account_id] = _append(accounts[account_id], amount, reason, ref)
+        return balances
+
+def set_balance(account_id, balance, reason, ref=None):
+    """Установить баланс (записывается как изменение на разницу)"""
+    with _lock:
+        account = _get(account_id)
+        return _append(account, balance - account['balance'], reason, ref)
+
+@contextmanager
+def round_transaction():
+    """Блок от записи ставки или выигрыша раунда в журнал до коммита транзакции раунда
+    (или записи отмены, если коммит не прошел).
+
+    Пока блок открыт, flush не снимает балансы: иначе в БД попало бы зачисление, которое
+    откатится вместе с транзакцией раунда, а его отмену восстановление не применит.
+    """
+    global _open_rounds
+    with _lock:
+        _open_rounds += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _open_rounds -= 1
+            if not _open_rounds:
+                _rounds_closed.notify_all()
+
+def flush():
+    """Перенести измененные балансы в accounts вместе с контрольной точкой журнала"""
+    with _flush_lock:
+        return _flush_locked()
+
+def _flush_locked():
+    """Перенос в БД; вызывается под _flush_lock"""
+    global _flushed_seq
+    with _lock:
+        if not _dirty:
+            return 0
+        if not _rounds_closed.wait_for(lambda: not _open_rounds, LEDGER_ROUND_WAIT):
+            # Транзакция раунда не закончилась - балансы останутся в журнале до следующего переноса
+            return 0
+        rows = [(_accounts[account_id]['balance'], account_id) for account_id in _dirty]
+        seq = _seq
+        _dirty.clear()
+        # Выигрыши, вошедшие в эти балансы, отмечаются оплаченными той же транзакцией
+        credited = [(round_id,) for _, round_id in _win_refs]
+        del _win_refs[:]
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany('UPDATE accounts SET balance = ? WHERE id = ?', rows)
+        cursor.executemany('UPDATE round_results SET credited = 1 WHERE round_id = ?', credited)
+        # Контрольная точка только растет
+        cursor.execute('''
+            INSERT INTO ledger_checkpoint (id, seq) VALUES (1, ?)
+            ON CONFLICT (id) DO UPDATE SET seq = excluded.seq WHERE seq < excluded.seq
+        ''', (seq,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        with _lock:
+            _dirty.update(account_id for _, account_id in rows)
+            _win_refs[:0] = [(seq, round_id) for round_id, in credited]
+        raise
+    finally:
+        conn.close()
+
+    with _lock:
+        _flushed_seq = max(_flushed_seq, seq)
+        # Все записи журнала уже в БД - журнал можно обнулить
+        if _seq == seq and _journal is not None:
+            _journal.truncate(0)
+            _journal.seek(0)
+    return len(rows)
+
+def get_stats():
+    """Состояние журнала: число аккаунтов, номер последней записи и последней перенесенной в БД"""
+    return {
+        'accounts': len(_accounts),
+        'seq': _seq,
+        'flushed_seq': _flushed_seq,
+        'pending_accounts': len(_dirty)
+    }
@@ -1,22 +1,39 @@
+# Сетевые вызовы (запросы к бирже, сокеты) должны уступать управление хабу eventlet,
+# иначе один медленный запрос останавливает все соединения. Патчим до остальных импортов
+import eventlet
+eventlet.monkey_patch()
+
 from flask import Flask, send_from_directory
 from flask_cors import CORS
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
+import atexit
 import os
+import sys
+import assets
+import json_provider
 
 # Определяем путь к frontend директории
 FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend')
 
 app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = 'lynx-trade-secret-key'
+# jsonify и пакеты Socket.IO сериализуются orjson, если он установлен (см. json_provider)
+app.json = json_provider.FastJSONProvider(app)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", json=json_provider.socketio_json)
+
+# При запуске `python app.py` этот модуль называется __main__. Регистрируем его и под именем
+# `app`, иначе `from app import socketio` в других модулях создаст второй экземпляр приложения,
+# и события из фоновых задач уйдут в SocketIO-сервер без клиентов
+if __name__ == '__main__':
+    sys.modules.setdefault('app', sys.modules[__name__])
 
 # Эндпоинты для HTML страниц
 @app.route('/')
 def index():
     """Главная страница с графиком"""
     try:
-        return send_from_directory(FRONTEND_DIR, 'index.html')
+        return assets.serve_asset('index.html') or send_from_directory(FRONTEND_DIR, 'index.html')
     except Exception as e:
         return f"Error loading index.html: {str(e)}", 404
     
@@ -24,7 +41,7 @@ def index():
 def index_traderoom():
     """Главная страница с графиком"""
     try:
-        return send_from_directory(FRONTEND_DIR, 'index.html')
+        return assets.serve_asset('index.html') or send_from_directory(FRONTEND_DIR, 'index.html')
     except Exception as e:
         return f"Error loading index.html: {str(e)}", 404
 
@@ -32,7 +49,7 @@ def index_traderoom():
 def admin():
     """Админ-панель"""
     try:
-        return send_from_directory(FRONTEND_DIR, 'admin.html')
+        return assets.serve_asset('admin.html') or send_from_directory(FRONTEND_DIR, 'admin.html')
     except Exception as e:
         return f"Error loading admin.html: {str(e)}", 404
 
@@ -40,16 +57,17 @@ def admin():
 def test():
     """Тестовая страница для проверки прямоугольников"""
     try:
-        return send_from_directory(FRONTEND_DIR, 'test.html')
+        return assets.serve_asset('test.html') or send_from_directory(FRONTEND_DIR, 'test.html')
     except Exception as e:
         return f"Error loading test.html: {str(e)}", 404
 
-# Статические файлы (CSS, JS, изображения)
+# Статические файлы (CSS, JS, изображения): из памяти с отпечатками и сжатием (см. assets.py),
+# файлы, появившиеся после старта, - с диска
 @app.route('/css/<path:filename>')
 def serve_css(filename):
     """Отдача CSS файлов"""
     try:
-        return send_from_directory(os.path.join(FRONTEND_DIR, 'css'), filename)
+        return assets.serve_asset(f'css/{filename}') or send_from_directory(os.path.join(FRONTEND_DIR, 'css'), filename)
     except Exception as e:
         return f"Error loading CSS: {str(e)}", 404
 
@@ -57,7 +75,7 @@ def serve_css(filename):
 def serve_js(filename):
     """Отдача JavaScript файлов"""
     try:
-        return send_from_directory(os.path.join(FRONTEND_DIR, 'js'), filename)
+        return assets.serve_asset(f'js/{filename}') or send_from_directory(os.path.join(FRONTEND_DIR, 'js'), filename)
     except Exception as e:
         return f"Error loading JS: {str(e)}", 404
 
@@ -70,12 +88,29 @@ def favicon():
 import models
 models.init_db()
 
+# Загружаем настройки в память (дальше их читают из кэша)
+import settings_cache
+settings_cache.load_settings()
+
+# Реестр торговых пар в памяти (перезагружается при изменении пар через API)
+import pair_registry
+pair_registry.load_pairs()
+
+# Балансы аккаунтов в памяти: загрузка из БД и восстановление по журналу после сбоя
+import account_ledger
+account_ledger.load_ledger()
+atexit.register(account_ledger.flush)
+
 # Импорт маршрутов
 import routes
 
 # Регистрация Blueprint
 app.register_blueprint(routes.api, url_prefix='/api')
 
+# Собираем статику в память: отпечатки содержимого и предварительно сжатые варианты
+if assets.ASSET_PIPELINE:
+    assets.build_assets(FRONTEND_DIR, routes.IMG_DIR)
+
 # Импорт WebSocket обработчиков (должен быть после создания socketio и регистрации routes)
 # Это должно быть ДО запуска приложения, чтобы обработчики зарегистрировались
 print('📦 Importing websocket handlers...')
@@ -85,9 +120,11 @@ print('✅ WebSocket handlers imported')
 # Регистрируем обработчики явно после импорта
 from flask import request
 from datetime import datetime
+import time
 
 # Импортируем connected_clients из websocket модуля
 import websocket
+import subscriptions
 
 @socketio.on('connect')
 def handle_connect():
@@ -119,6 +156,8 @@ def handle_disconnect():
     try:
         client_id = request.sid
         websocket.connected_clients.discard(client_id)
+        # Из комнат Socket.IO клиент выходит сам, счетчики подписок чистим явно
+        subscriptions.unsubscribe_all(client_id)
         print(f'❌ Client disconnected - SID: {client_id} (Total: {len(websocket.connected_clients)})')
     except Exception as e:
         print(f'❌ Error in disconnect handler: {e}')
@@ -131,6 +170,9 @@ def handle_subscribe_rounds(data):
         client_id = request.sid
         # Убеждаемся, что клиент в списке
         websocket.connected_clients.add(client_id)
+        # Результаты раундов пользователя приходят в его комнату
+        from trading_logic import user_room
+        join_room(user_room(user_id))
         print(f'✅✅✅ User {user_id} subscribed to rounds (SID: {client_id})')
         print(f'✅✅✅ Connected clients after subscribe: {len(websocket.connected_clients)} - {list(websocket.connected_clients)}')
         
@@ -148,6 +190,108 @@ def handle_subscribe_rounds(data):
         import traceback
         traceback.print_exc()
 
+def _price_subscription_keys(data):
+    """Ключи подписки на цены из {pair_id} или {pair_ids: [...]} (None, если данные неверны)"""
+    data = data or {}
+    pair_ids = data.get('pair_ids')
+    if pair_ids is None:
+        pair_ids = [data.get('pair_id')]
+    if not isinstance(pair_ids, list):
+        return None
+    try:
+        return [('prices', int(pair_id)) for pair_id in pair_ids]
+    except (TypeError, ValueError):
+        return None
+
+@socketio.on('subscribe_prices')
+def handle_subscribe_prices(data):
+    """Подписка на цены выбранных пар (кадры prices_batch)"""
+    try:
+        keys = _price_subscription_keys(data)
+        if keys is None:
+            return {'error': 'pair_id or pair_ids are required'}
+        # Кадры цен рассылаются по sid подписчиков (emit_price_batches), без комнат
+        for key in keys:
+            subscriptions.subscribe(request.sid, key)
+        
+        # Сразу отправляем полный кадр по новым парам, не дожидаясь снимка
+        import time
+        import price_frames
+        from utils import get_active_pair_prices
+        prices = get_active_pair_prices([pair_id for _, pair_id in keys])
+        if prices:
+            frame = price_frames.build_frame(
+                price_frames.current_seq(),
+                {pair_id: item['price'] for pair_id, item in prices.items()},
+                True, time.time()
+            )
+            socketio.emit('prices_batch', frame, to=request.sid)
+        return {'ok': True}
+    except Exception as e:
+        print(f'❌ Error in subscribe_prices handler: {e}')
+        return {'error': str(e)}
+
+@socketio.on('unsubscribe_prices')
+def handle_unsubscribe_prices(data):
+    """Отписка от цен выбранных пар"""
+    try:
+        keys = _price_subscription_keys(data)
+        if keys is None:
+            return {'error': 'pair_id or pair_ids are required'}
+        for key in keys:
+            subscriptions.unsubscribe(request.sid, key)
+        return {'ok': True}
+    except Exception as e:
+        print(f'❌ Error in unsubscribe_prices handler: {e}')
+        return {'error': str(e)}
+
+def _candle_subscription_key(data):
+    """Ключ подписки на живые свечи из {pair_id, timeframe} (None, если данные неверны)"""
+    from candle_aggregator import parse_timeframe
+    try:
+        pair_id = int((data or {}).get('pair_id'))
+    except (TypeError, ValueError):
+        return None
+    timeframe = (data or {}).get('timeframe') or '1m'
+    if parse_timeframe(timeframe) is None:
+        return None
+    return ('candles', pair_id, timeframe)
+
+@socketio.on('subscribe_candles')
+def handle_subscribe_candles(data):
+    """Подписка на обновления текущей свечи пары (candle_update / candle_closed)"""
+    try:
+        key = _candle_subscription_key(data)
+        if key is None:
+            return {'error': 'pair_id and valid timeframe are required'}
+        join_room(subscriptions.room_name(key))
+        subscriptions.subscribe(request.sid, key)
+        return {'ok': True}
+    except Exception as e:
+        print(f'❌ Error in subscribe_candles handler: {e}')
+        return {'error': str(e)}
+
+@socketio.on('unsubscribe_candles')
+def handle_unsubscribe_candles(data):
+    """Отписка от обновлений текущей свечи"""
+    try:
+        key = _candle_subscription_key(data)
+        if key is None:
+            return {'error': 'pair_id and valid timeframe are required'}
+        leave_room(subscriptions.room_name(key))
+        subscriptions.unsubscribe(request.sid, key)
+        return {'ok': True}
+    except Exception as e:
+        print(f'❌ Error in unsubscribe_candles handler: {e}')
+        return {'error': str(e)}
+
+@socketio.on('time_sync')
+def handle_time_sync(data):
+    """Замер для синхронизации часов клиента (как в NTP): время получения и ответа сервера в мс"""
+    t1 = time.time() * 1000
+    t0 = (data or {}).get('t0') if isinstance(data, dict) else None
+    return {'t0': t0, 't1': t1, 't2': time.time() * 1000}
+
 @socketio.on('test_event')
 def handle_test_event(data):
     """Тестовый обработчик"""
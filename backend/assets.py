@@ -0,0 +1,125 @@
+import hashlib
+import mimetypes
+import os
+import re
+from flask import Response, request
+
+from http_cache import COMPRESSIBLE_MIMETYPES, brotli, compress
+
+# Раздавать статику из памяти (отпечатки, предварительное сжатие). 0 - читать файлы с диска
+# на каждый запрос, как раньше (удобно при правке фронтенда без перезапуска)
+ASSET_PIPELINE = os.environ.get('ASSET_PIPELINE', '1') == '1'
+
+# Адреса с отпечатком содержимого не меняются никогда - кэшируем навсегда
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Адреса без отпечатка (HTML, старые ссылки) браузер перепроверяет по ETag
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+HASH_LENGTH = 12
+
+# Логический путь ('js/app.js', 'img/mini-logo.png', 'index.html') -> ассет
+_assets = {}
+# Путь с отпечатком ('js/app.3f2a9c1d0b7e.js') -> логический путь
+_fingerprints = {}
+
+_CSS_IMG_URL_RE = re.compile(r'''url\((['"]?)/api/img/([^'")]+)\1\)''')
+_HTML_REF_RE = re.compile(r'''(href|src)="((?:css|js)/[^"?#]+)"''')
+
+def fingerprinted_path(path, digest):
+    """'js/app.js' -> 'js/app.<hash>.js'"""
+    base, ext = os.path.splitext(path)
+    return f'{base}.{digest}{ext}'
+
+def asset_url(path):
+    """Путь с отпечатком для логического пути (или сам путь, если ассета нет)"""
+    asset = _assets.get(path)
+    return asset['url'] if asset else path
+
+def _add_asset(path, data):
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    variants = {None: data}
+    if mimetype in COMPRESSIBLE_MIMETYPES:
+        encodings = ['gzip', 'br'] if brotli is not None else ['gzip']
+        for encoding in encodings:
+            compressed = compress(data, encoding, best=True)
+            if len(compressed) < len(data):
+                variants[encoding] = compressed
+
+    url = fingerprinted_path(path, digest)
+    _assets[path] = {'digest': digest, 'mimetype': mimetype, 'variants': variants, 'url': url}
+    _fingerprints[url] = path
+
+def _read_files(directory, extensions):
+    """(имя, байты) файлов каталога с нужными расширениями"""
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for name in sorted(os.listdir(directory)):
+        full_path = os.path.join(directory, name)
+        if os.path.isfile(full_path) and os.path.splitext(name)[1] in extensions:
+            with open(full_path, 'rb') as f:
+                files.append((name, f.read()))
+    return files
+
+def build_assets(frontend_dir, img_dir):
+    """Собрать ассеты в память: картинки, затем CSS и JS, затем HTML.
+
+    Порядок важен: в CSS ссылки на /api/img заменяются адресами с отпечатком, в HTML -
+    ссылки на css/ и js/, поэтому отпечаток страницы меняется вместе с любым ее ресурсом.
+    """
+    _assets.clear()
+    _fingerprints.clear()
+
+    for name, data in _read_files(img_dir, {'.png', '.ico', '.jpg', '.jpeg', '.gif', '.svg', '.webp'}):
+        _add_asset(f'img/{name}', data)
+
+    def img_url(match):
+        return f"url({match.group(1)}/api/{asset_url('img/' + match.group(2))}{match.group(1)})"
+
+    for name, data in _read_files(os.path.join(frontend_dir, 'css'), {'.css'}):
+        text = _CSS_IMG_URL_RE.sub(img_url, data.decode('utf-8'))
+        _add_asset(f'css/{name}', text.encode('utf-8'))
+
+    for name, data in _read_files(os.path.join(frontend_dir, 'js'), {'.js'}):
+        _add_asset(f'js/{name}', data)
+
+    def ref_url(match):
+        return f'{match.group(1)}="{asset_url(match.group(2))}"'
+
+    for name, data in _read_files(frontend_dir, {'.html'}):
+        text = _HTML_REF_RE.sub(ref_url, data.decode('utf-8'))
+        _add_asset(name, text.encode('utf-8'))
+
+    total = sum(len(asset['variants'][None]) for asset in _assets.values())
+    print(f'📦 [assets] Built {len(_assets)} assets ({total // 1024} KB)')
+    return len(_assets)
+
+def serve_asset(path):
+    """Ответ с ассетом из памяти или None, если такого ассета нет (тогда отдаем с диска)"""
+    if not ASSET_PIPELINE:
+        return None
+    logical = _fingerprints.get(path)
+    asset = _assets.get(logical or path)
+    if asset is None:
+        return None
+
+    cache_control = IMMUTABLE_CACHE_CONTROL if logical else REVALIDATE_CACHE_CONTROL
+    variants = asset['variants']
+
+    if request.if_none_match.contains_weak(asset['digest']):
+        response = Response(status=304)
+    else:
+        accepted = request.accept_encodings
+        encoding = next((name for name in ('br', 'gzip') if name in variants and accepted[name]), None)
+        response = Response(variants[encoding], mimetype=asset['mimetype'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    # Один ETag на все представления (сжатые и нет) - поэтому слабый
+    response.set_etag(asset['digest'], weak=True)
+    response.headers['Cache-Control'] = cache_control
+    if len(variants) > 1:
+        response.vary.add('Accept-Encoding')
+    return response
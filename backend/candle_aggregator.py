@@ -0,0 +1,102 @@
+import re
+import threading
+import numpy as np
+
+# Базовый таймфрейм: хранится и синхронизируется только он, остальные выводятся из него
+BASE_TIMEFRAME = '1m'
+BASE_SECONDS = 60
+
+_TIMEFRAME_RE = re.compile(r'^(\d+)([mhd])$')
+_UNIT_SECONDS = {'m': 60, 'h': 3600, 'd': 86400}
+
+# Поддерживаемые таймфреймы (как у Binance, не длиннее суток). Кэш агрегатов, подписки
+# на живые свечи и симулятор работают по интервалу, поэтому произвольные значения не принимаем
+SUPPORTED_TIMEFRAMES = ('1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d')
+
+# Сколько последних агрегированных свечей держим в кэше на (symbol, interval)
+MAX_ROLLUP_CANDLES = 5000
+
+# Кэш агрегированных рядов: (symbol, interval) -> dict массивов
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+def parse_timeframe(timeframe):
+    """'1m', '30m', '4h', '1d' -> длительность в секундах (None, если таймфрейм не поддерживается)"""
+    if timeframe not in SUPPORTED_TIMEFRAMES:
+        return None
+    match = _TIMEFRAME_RE.match(timeframe)
+    if not match:
+        return None
+    seconds = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    if seconds <= 0 or seconds % BASE_SECONDS:
+        return None
+    return seconds
+
+def resample(times, opens, highs, lows, closes, volumes, interval):
+    """Свернуть отсортированные 1m свечи в свечи длительностью interval (векторно)"""
+    times = np.asarray(times, dtype=np.int64)
+    if times.size == 0:
+        empty = np.empty(0)
+        return {'time': np.empty(0, dtype=np.int64), 'open': empty, 'high': empty,
+                'low': empty, 'close': empty, 'volume': empty}
+
+    # Начало бакета, выровненное по эпохе (как у Binance)
+    buckets = times - times % interval
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], times.size] - 1
+
+    return {
+        'time': buckets[starts],
+        'open': np.asarray(opens, dtype=np.float64)[starts],
+        'high': np.maximum.reduceat(np.asarray(highs, dtype=np.float64), starts),
+        'low': np.minimum.reduceat(np.asarray(lows, dtype=np.float64), starts),
+        'close': np.asarray(closes, dtype=np.float64)[ends],
+        'volume': np.add.reduceat(np.asarray(volumes, dtype=np.float64), starts)
+    }
+
+def resample_rows(rows, interval):
+    """resample для строк (open_time, open, high, low, close, volume)"""
+    if not rows:
+        return resample([], [], [], [], [], [], interval)
+    columns = np.array(rows, dtype=np.float64).T
+    return resample(columns[0].astype(np.int64), columns[1], columns[2], columns[3],
+                    columns[4], columns[5], interval)
+
+def to_chart_candles(series, limit=None):
+    """Массивы свечей -> список словарей в формате графика"""
+    start = 0 if limit is None else max(0, series['time'].size - limit)
+    return [
+        {'time': int(t), 'open': float(o), 'high': float(h), 'low': float(l), 'close': float(c)}
+        for t, o, h, l, c in zip(
+            series['time'][start:], series['open'][start:], series['high'][start:],
+            series['low'][start:], series['close'][start:]
+        )
+    ]
+
+def get_rollup(symbol, interval, since, load_base):
+    """Агрегированный ряд (symbol, interval) начиная с since.
+
+    load_base(start_time) возвращает 1m строки с open_time >= start_time. Кэшированный ряд
+    обновляется инкрементально: пересчитывается только последний (незакрытый) бакет и новые.
+    """
+    key = (symbol, interval)
+    since = since - since % interval
+    cached = _rollups.get(key)
+
+    if cached is None or cached['time'].size == 0 or cached['time'][0] > since:
+        # Первый запрос или нужна более глубокая история - считаем заново
+        series = resample_rows(load_base(since), interval)
+    else:
+        # Последний бакет мог быть незакрытым: отбрасываем его и досчитываем с его начала
+        last_bucket = int(cached['time'][-1])
+        tail = resample_rows(load_base(last_bucket), interval)
+        series = {
+            name: np.concatenate((cached[name][:-1], tail[name]))
+            for name in cached
+        }
+        if series['time'].size > MAX_ROLLUP_CANDLES:
+            series = {name: values[-MAX_ROLLUP_CANDLES:] for name, values in series.items()}
+
+    with _rollups_lock:
+        _rollups[key] = series
+    return series
@@ -0,0 +1,104 @@
+import zlib
+from functools import lru_cache
+import numpy as np
+
+from candle_aggregator import BASE_SECONDS, resample, to_chart_candles
+from price_model import BASE_PRICES
+
+SECONDS_PER_DAY = 86400
+MINUTES_PER_DAY = SECONDS_PER_DAY // BASE_SECONDS
+
+# Стандартное отклонение дневного лог-изменения цены
+DAILY_VOLATILITY = 0.02
+# Масштаб теней свечи относительно тела
+WICK_VOLATILITY = 0.0005
+# Скорость возврата дневного уровня к базовой цене (разброс около ±6%)
+ANCHOR_REVERSION = 0.05
+# На сколько дней от эпохи заранее считаем дневные опорные уровни (2^15 дней - до 2059 года)
+ANCHOR_DAYS = 1 << 15
+# Сколько последних дней может охватить один запрос (более глубокая история не строится).
+# Столько же дневных путей держит кэш, поэтому даже самый глубокий запрос не вытесняет сам себя
+MAX_SIMULATED_DAYS = 256
+
+def _symbol_seed(symbol):
+    """Стабильный (между запусками) seed для символа"""
+    return zlib.crc32(symbol.encode())
+
+@lru_cache(maxsize=64)
+def _daily_anchors(symbol):
+    """Лог-уровень цены на начало каждого дня: блуждание от эпохи с возвратом к базовой цене"""
+    rng = np.random.default_rng([_symbol_seed(symbol), 0])
+    steps = rng.normal(0.0, DAILY_VOLATILITY, ANCHOR_DAYS).tolist()
+    # Без возврата к среднему цена за десятки тысяч дней ушла бы от базовой в разы.
+    # Считается один раз на символ (результат кэшируется)
+    anchors = [0.0]
+    for step in steps:
+        anchors.append(anchors[-1] * (1 - ANCHOR_REVERSION) + step)
+    anchors = np.array(anchors)
+    anchors.flags.writeable = False
+    return anchors
+
+@lru_cache(maxsize=MAX_SIMULATED_DAYS)
+def _day_path(symbol, day):
+    """Лог-уровни на границах минут дня (1441 точка) и тени свечей (2 x 1440).
+
+    Внутри дня - броуновский мост между дневными опорными уровнями, поэтому
+    соседние дни стыкуются без разрывов и каждый день считается независимо.
+    """
+    anchors = _daily_anchors(symbol)
+    start_level = anchors[day % ANCHOR_DAYS]
+    end_level = anchors[day % ANCHOR_DAYS + 1]
+
+    rng = np.random.default_rng([_symbol_seed(symbol), 1, day])
+    walk = np.concatenate(([0.0], np.cumsum(rng.normal(0.0, 1.0, MINUTES_PER_DAY))))
+    fraction = np.linspace(0.0, 1.0, MINUTES_PER_DAY + 1)
+    bridge = walk - fraction * walk[-1]
+    levels = start_level + (end_level - start_level) * fraction + bridge * (DAILY_VOLATILITY / np.sqrt(MINUTES_PER_DAY))
+    wicks = np.abs(rng.normal(0.0, WICK_VOLATILITY, (2, MINUTES_PER_DAY)))
+
+    levels.flags.writeable = False
+    wicks.flags.writeable = False
+    return levels, wicks
+
+def simulate_base_candles(symbol, start_time, end_time):
+    """Детерминированные 1m свечи с open_time в [start_time, end_time] (массивы).
+
+    Не больше MAX_SIMULATED_DAYS дней: более ранний start_time сдвигается к началу допустимого окна.
+    """
+    end_time -= end_time % BASE_SECONDS
+    start_time = max(start_time, (end_time // SECONDS_PER_DAY - MAX_SIMULATED_DAYS + 1) * SECONDS_PER_DAY)
+    start_time -= start_time % BASE_SECONDS
+    times = np.arange(start_time, end_time + BASE_SECONDS, BASE_SECONDS, dtype=np.int64)
+
+    first_day = start_time // SECONDS_PER_DAY
+    last_day = end_time // SECONDS_PER_DAY
+    paths = [_day_path(symbol, day) for day in range(first_day, last_day + 1)]
+
+    # Склеиваем дни: уровни на открытии и закрытии каждой минуты подряд
+    open_levels = np.concatenate([levels[:-1] for levels, _ in paths])
+    close_levels = np.concatenate([levels[1:] for levels, _ in paths])
+    upper = np.concatenate([wicks[0] for _, wicks in paths])
+    lower = np.concatenate([wicks[1] for _, wicks in paths])
+
+    offset = (start_time - first_day * SECONDS_PER_DAY) // BASE_SECONDS
+    window = slice(offset, offset + times.size)
+
+    base = BASE_PRICES.get(symbol, 100.0)
+    opens = base * np.exp(open_levels[window])
+    closes = base * np.exp(close_levels[window])
+    highs = np.maximum(opens, closes) * np.exp(upper[window])
+    lows = np.minimum(opens, closes) * np.exp(-lower[window])
+    return times, opens, highs, lows, closes
+
+def generate_candles(symbol, interval, limit, end_time):
+    """Последние limit свечей длительностью interval на момент end_time (всегда одинаковые).
+
+    limit урезается так, чтобы свечи уложились в MAX_SIMULATED_DAYS дней.
+    """
+    limit = max(1, min(limit, (MAX_SIMULATED_DAYS - 1) * SECONDS_PER_DAY // interval))
+    first = end_time - end_time % interval - interval * (limit - 1)
+    times, opens, highs, lows, closes = simulate_base_candles(symbol, first, end_time)
+    series = resample(times, opens, highs, lows, closes, np.zeros(times.size), interval)
+    for name in ('open', 'high', 'low', 'close'):
+        series[name] = np.round(series[name], 5)
+    return to_chart_candles(series, limit)
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+
+import market_data
+from models import get_db
+from candle_aggregator import BASE_TIMEFRAME, BASE_SECONDS, parse_timeframe, get_rollup, to_chart_candles
+
+# Binance отдает не более 1000 свечей за запрос
+KLINES_PAGE_LIMIT = 1000
+# Сколько страниц догружать за одну синхронизацию (после долгого простоя)
+KLINES_MAX_PAGES = 5
+# Сколько страниц истории можно догрузить назад за один запрос графика
+KLINES_MAX_BACKFILL_PAGES = 10
+
+# Не чаще чем раз в столько секунд ходим к Binance за новыми свечами одного символа
+CANDLE_SYNC_INTERVAL = float(os.environ.get('CANDLE_SYNC_INTERVAL', '5'))
+# Больше свечей за один запрос графика не отдаем
+CHART_MAX_LIMIT = 1000
+# Самый крупный таймфрейм, для которого хранится полная глубина графика (CHART_MAX_LIMIT свечей)
+CHART_MAX_TIMEFRAME = os.environ.get('CHART_MAX_TIMEFRAME', '4h')
+# Сколько последних 1m свечей храним на символ: по умолчанию CHART_MAX_LIMIT свечей
+# CHART_MAX_TIMEFRAME (4h - 240000, около 167 дней). Для более крупных таймфреймов глубина меньше
+CANDLE_RETENTION = int(os.environ.get(
+    'CANDLE_RETENTION',
+    str(parse_timeframe(CHART_MAX_TIMEFRAME) // BASE_SECONDS * CHART_MAX_LIMIT)
+))
+
+# symbol -> время последней синхронизации
+_last_sync = {}
+# Символы, для которых Binance больше не отдает более старую историю
+_history_exhausted = set()
+_sync_lock = threading.Lock()
+
+def retention_start(now=None):
+    """Время открытия самой старой 1m свечи, которую еще храним"""
+    now = int(time.time()) if now is None else int(now)
+    return now - now % BASE_SECONDS - (CANDLE_RETENTION - 1) * BASE_SECONDS
+
+def max_chart_limit(interval):
+    """Сколько свечей длительностью interval (секунды) можно отдать из хранимой 1m истории"""
+    return max(1, min(CHART_MAX_LIMIT, CANDLE_RETENTION * BASE_SECONDS // interval))
+
+def get_stored_range(symbol):
+    """(первое, последнее) время открытия сохраненных 1m свечей или (None, None)"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT MIN(open_time), MAX(open_time) FROM candles WHERE symbol = ? AND timeframe = ?',
+        (symbol, BASE_TIMEFRAME)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    return (row[0], row[1]) if row else (None, None)
+
+def fetch_klines(symbol, start_time=None, end_time=None, limit=KLINES_PAGE_LIMIT):
+    """Загрузить 1m свечи с Binance (start_time/end_time - в секундах, включительно)"""
+    params = {'symbol': symbol, 'interval': BASE_TIMEFRAME, 'limit': limit}
+    if start_time is not None:
+        params['startTime'] = int(start_time * 1000)
+    if end_time is not None:
+        params['endTime'] = int(end_time * 1000)
+    return [
+        (int(k[0] / 1000), float(k[1]), float(k[2]), float(k[3]), float(k[4]), float(k[5]))
+        for k in market_data.get_json('klines', params)
+    ]
+
+def save_candles(symbol, candles):
+    """Сохранить 1m свечи (open_time, open, high, low, close, volume); последняя может быть незакрытой"""
+    if not candles:
+        return
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT OR REPLACE INTO candles (symbol, timeframe, open_time, open, high, low, close, volume)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(symbol, BASE_TIMEFRAME) + tuple(candle) for candle in candles])
+    # Храним только последние CANDLE_RETENTION минут: удаление по времени - диапазон
+    # первичного ключа, без обхода всех хранимых свечей символа
+    cursor.execute(
+        'DELETE FROM candles WHERE symbol = ? AND timeframe = ? AND open_time < ?',
+        (symbol, BASE_TIMEFRAME, retention_start())
+    )
+    conn.commit()
+    conn.close()
+
+def sync_candles(symbol, since=None, force=False):
+    """Догрузить с Binance только 1m свечи новее последней сохраненной.
+
+    Если задан since, а сохраненная история начинается позже - догружаем историю назад.
+    """
+    first_open_time, last_open_time = get_stored_range(symbol)
+    total = 0
+
+    now = time.time()
+    with _sync_lock:
+        due = force or now - _last_sync.get(symbol, 0) >= CANDLE_SYNC_INTERVAL
+        if due:
+            # Отмечаем заранее, чтобы параллельные запросы не дублировали синхронизацию
+            _last_sync[symbol] = now
+
+    if last_open_time is None:
+        # Первичная загрузка истории
+        candles = fetch_klines(symbol)
+        save_candles(symbol, candles)
+        print(f'📥 [candle_store] Backfilled {len(candles)} 1m candles for {symbol}')
+        if not candles:
+            return 0
+        first_open_time = candles[0][0]
+        total += len(candles)
+    elif due:
+        # Инкрементальная догрузка: начиная с последней сохраненной свечи (она могла быть незакрытой)
+        start_time = last_open_time
+        for _ in range(KLINES_MAX_PAGES):
+            candles = fetch_klines(symbol, start_time=start_time)
+            save_candles(symbol, candles)
+            total += len(candles)
+            if len(candles) < KLINES_PAGE_LIMIT:
+                break
+            start_time = candles[-1][0]
+
+    # Догрузка истории назад, если для запрошенного таймфрейма ее не хватает
+    if since is not None and symbol not in _history_exhausted:
+        since = max(since, retention_start(now))
+        pages = 0
+        while first_open_time > since and pages < KLINES_MAX_BACKFILL_PAGES:
+            candles = fetch_klines(symbol, end_time=first_open_time - BASE_SECONDS)
+            save_candles(symbol, candles)
+            pages += 1
+            total += len(candles)
+            if len(candles) < KLINES_PAGE_LIMIT:
+                # Раньше истории нет (пара начала торговаться позже)
+                _history_exhausted.add(symbol)
+                break
+            first_open_time = candles[0][0]
+    return total
+
+def load_base_candles(symbol, start_time):
+    """1m строки (open_time, open, high, low, close, volume) с open_time >= start_time"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT open_time, open, high, low, close, volume
+        FROM candles
+        WHERE symbol = ? AND timeframe = ? AND open_time >= ?
+        ORDER BY open_time
+    ''', (symbol, BASE_TIMEFRAME, start_time))
+    rows = cursor.fetchall()
+    conn.close()
+    return [tuple(row) for row in rows]
+
+def get_candles(symbol, timeframe, limit):
+    """Последние limit свечей таймфрейма (любого, кратного минуте) в формате графика"""
+    interval = parse_timeframe(timeframe) or BASE_SECONDS
+    since = int(time.time()) - interval * limit
+
+    if interval == BASE_SECONDS:
+        rows = load_base_candles(symbol, since - since % BASE_SECONDS)
+        return [
+            {'time': row[0], 'open': row[1], 'high': row[2], 'low': row[3], 'close': row[4]}
+            for row in rows[-limit:]
+        ]
+
+    series = get_rollup(symbol, interval, since, lambda start: load_base_candles(symbol, start))
+    return to_chart_candles(series, limit)
@@ -0,0 +1,88 @@
+import gzip
+import os
+from functools import wraps
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаем только gzip
+    brotli = None
+
+# Тела меньше этого размера (байт) не сжимаем - выигрыш меньше накладных расходов
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/css', 'text/plain',
+                          'application/javascript', 'text/javascript', 'image/svg+xml'}
+
+def versioned(get_version, name, cache_control='no-cache'):
+    """Декоратор: ETag по версии ресурса и 304 на If-None-Match без вызова обработчика"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = f'{name}-{get_version()}'
+            # Слабое сравнение: сжатый ответ отдается со слабым ETag (см. compress_response)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+def cached(cache_control='no-cache'):
+    """Декоратор: ETag по содержимому ответа, 304 на If-None-Match и заданный Cache-Control.
+
+    Для ресурсов без версии: обработчик выполняется, но неизменившееся тело не передается.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.headers['Cache-Control'] = cache_control
+            response.add_etag()
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+def choose_encoding(accept_encodings):
+    """Лучшее поддерживаемое сжатие для Accept-Encoding ('br', 'gzip' или None)"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress(data, encoding, best=False):
+    """Сжать байты в gzip или br (best - максимальная степень, для предварительного сжатия)"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+def compress_response(response):
+    """after_request: сжать большое тело ответа, если клиент это поддерживает"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # Байты сжатого ответа другие - ETag становится слабым (тот же ресурс, другое представление)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
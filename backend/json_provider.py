@@ -0,0 +1,80 @@
+import json
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает стандартный json
+    orjson = None
+
+# auto - orjson, если установлен; stdlib - всегда стандартный json
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+# Ключи-числа ({pair_id: ...}) превращаются в строки, как в стандартном json;
+# numpy-значения из симулятора свечей сериализуются напрямую
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+def _default(obj):
+    """Типы, которых нет в orjson (Decimal, UUID и т.п.) - как в Flask"""
+    return DefaultJSONProvider.default(obj)
+
+def use_fast():
+    """Используется ли быстрый сериализатор"""
+    return orjson is not None and JSON_BACKEND != 'stdlib'
+
+def backend_name():
+    return 'orjson' if use_fast() else 'json'
+
+def dumps_bytes(obj):
+    """Сериализовать в компактный JSON (bytes, UTF-8)"""
+    if use_fast():
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def dumps(obj, **kwargs):
+    """Сериализовать в JSON-строку (параметры форматирования учитывает только стандартный json)"""
+    if use_fast():
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode('utf-8')
+    kwargs.setdefault('default', _default)
+    return json.dumps(obj, **kwargs)
+
+def loads(s, **kwargs):
+    """Разобрать JSON из str или bytes"""
+    if use_fast():
+        return orjson.loads(s)
+    return json.loads(s, **kwargs)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON провайдер Flask (jsonify, request.json) поверх быстрого сериализатора"""
+
+    def dumps(self, obj, **kwargs):
+        if use_fast():
+            return dumps(obj)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if not use_fast():
+            return super().response(*args, **kwargs)
+        # Тело сразу в bytes, без промежуточной строки
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+class SocketIOJSON:
+    """json-модуль для python-socketio (нужны dumps и loads, dumps возвращает str).
+
+    Пакет события кодируется один раз на emit и переиспользуется всеми получателями комнаты
+    или списка sid, поэтому рассылка одного кадра многим клиентам - одна сериализация.
+    """
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return dumps(obj, **kwargs)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return loads(s, **kwargs)
+
+socketio_json = SocketIOJSON()
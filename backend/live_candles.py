@@ -0,0 +1,65 @@
+import threading
+
+from candle_aggregator import parse_timeframe
+
+# Текущая (незакрытая) свеча по (pair_id, timeframe)
+_candles = {}
+_lock = threading.Lock()
+
+def _seed_candle(symbol, timeframe, bucket, price):
+    """Начальная свеча: берем уже накопленную с Binance, если она есть в хранилище"""
+    if symbol and symbol.endswith('USDT'):
+        try:
+            from candle_store import get_candles
+            stored = get_candles(symbol, timeframe, 1)
+            if stored and stored[-1]['time'] == bucket:
+                return dict(stored[-1])
+        except Exception as e:
+            print(f'Error seeding live candle for {symbol} {timeframe}: {e}')
+    return {'time': bucket, 'open': price, 'high': price, 'low': price, 'close': price}
+
+def on_price(pair_id, symbol, timeframe, price, timestamp):
+    """Применить новую цену к текущей свече.
+
+    Возвращает (closed, current): closed - закрытая свеча при смене интервала (или None),
+    current - текущая свеча, если она изменилась (или None).
+    """
+    interval = parse_timeframe(timeframe)
+    if interval is None:
+        return None, None
+    bucket = int(timestamp) - int(timestamp) % interval
+    key = (pair_id, timeframe)
+
+    previous = _candles.get(key)
+    candle = previous
+    closed = None
+    if candle is None:
+        candle = _seed_candle(symbol, timeframe, bucket, price)
+    elif bucket > candle['time']:
+        closed = candle
+        candle = {'time': bucket, 'open': price, 'high': price, 'low': price, 'close': price}
+    elif bucket < candle['time']:
+        # Запоздавшая цена из прошлого интервала
+        return None, None
+
+    updated = {
+        'time': candle['time'],
+        'open': candle['open'],
+        'high': max(candle['high'], price),
+        'low': min(candle['low'], price),
+        'close': price
+    }
+    with _lock:
+        _candles[key] = updated
+    # Без изменений (цена та же) - нечего рассылать
+    return closed, (updated if updated != previous else None)
+
+def discard(keys):
+    """Забыть текущие свечи для (pair_id, timeframe), на которые больше никто не подписан"""
+    with _lock:
+        for key in keys:
+            _candles.pop(key, None)
+
+def tracked_keys():
+    """(pair_id, timeframe), для которых строится текущая свеча"""
+    return list(_candles)
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+# Базовый адрес рыночных данных (для тестов можно указать локальный HTTP сервер)
+MARKET_DATA_BASE_URL = os.environ.get('MARKET_DATA_BASE_URL', 'https://api.binance.com')
+
+# Размер пула keep-alive соединений и предел одновременных запросов к бирже
+MARKET_DATA_POOL_SIZE = int(os.environ.get('MARKET_DATA_POOL_SIZE', '10'))
+MARKET_DATA_MAX_CONCURRENCY = int(os.environ.get('MARKET_DATA_MAX_CONCURRENCY', '8'))
+
+# Сколько ждать свободного слота, прежде чем считать биржу перегруженной (секунды)
+MARKET_DATA_QUEUE_TIMEOUT = float(os.environ.get('MARKET_DATA_QUEUE_TIMEOUT', '2'))
+
+# Таймауты (connect, read) по эндпоинтам
+ENDPOINT_TIMEOUTS = {
+    'ticker/price': (2, 3),
+    'klines': (2, 5),
+    'exchangeInfo': (3, 10),
+    'ping': (2, 2),
+}
+DEFAULT_TIMEOUT = (2, 5)
+
+# Сколько последних замеров задержки держим для перцентилей
+LATENCY_WINDOW = 256
+
+# Circuit breaker: после стольких сбоев подряд запросы к бирже сразу отклоняются...
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '3'))
+# ...пока фоновая проверка (или пробный запрос после этой паузы, секунды) не пройдет успешно
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', '10'))
+
+class UpstreamBusy(requests.exceptions.RequestException):
+    """Все слоты для запросов к бирже заняты дольше MARKET_DATA_QUEUE_TIMEOUT"""
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Биржа недоступна: запрос отклонен без обращения к сети"""
+
+_session = None
+_base_url = MARKET_DATA_BASE_URL
+_slots = threading.BoundedSemaphore(MARKET_DATA_MAX_CONCURRENCY)
+_session_lock = threading.Lock()
+
+# Состояние circuit breaker: closed - запросы идут, open - отклоняются до retry_at
+_circuit = {'state': 'closed', 'failures': 0, 'opened_at': None, 'retry_at': 0.0, 'trial': False}
+_circuit_lock = threading.Lock()
+
+# Метрики по эндпоинтам: endpoint -> {requests, errors, ...}
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def configure(base_url=None):
+    """Сменить базовый адрес (например, на локальный сервер в тестах) и пересоздать сессию"""
+    global _session, _base_url
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _base_url = (base_url or MARKET_DATA_BASE_URL).rstrip('/')
+        _metrics.clear()
+    with _circuit_lock:
+        _circuit.update(state='closed', failures=0, opened_at=None, retry_at=0.0, trial=False)
+
+def get_session():
+    """Общая сессия с пулом keep-alive соединений"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=MARKET_DATA_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def _record(endpoint, latency, error=None):
+    with _metrics_lock:
+        stats = _metrics.get(endpoint)
+        if stats is None:
+            stats = _metrics[endpoint] = {
+                'requests': 0, 'errors': 0, 'latencies': deque(maxlen=LATENCY_WINDOW),
+                'last_error': None, 'last_error_at': None
+            }
+        stats['requests'] += 1
+        if latency is not None:
+            stats['latencies'].append(latency)
+        if error is not None:
+            stats['errors'] += 1
+            stats['last_error'] = error
+            stats['last_error_at'] = time.time()
+
+def _is_upstream_failure(error):
+    """Сбой биржи (сеть, таймаут, 5xx, мусор вместо JSON), а не ошибка запроса (4xx)"""
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return not isinstance(error, UpstreamBusy)
+
+def _allow_request():
+    """Пропустить запрос через breaker: при open - только один пробный после retry_at"""
+    with _circuit_lock:
+        if _circuit['state'] == 'closed':
+            return True
+        if time.time() >= _circuit['retry_at'] and not _circuit['trial']:
+            _circuit['trial'] = True
+            return True
+        return False
+
+def _on_success():
+    with _circuit_lock:
+        was_open = _circuit['state'] == 'open'
+        _circuit.update(state='closed', failures=0, opened_at=None, trial=False)
+    if was_open:
+        print('✅ [market_data] Upstream is healthy again, circuit closed')
+
+def _on_failure():
+    with _circuit_lock:
+        _circuit['failures'] += 1
+        _circuit['trial'] = False
+        opening = _circuit['state'] == 'closed' and _circuit['failures'] >= CIRCUIT_FAILURE_THRESHOLD
+        if opening:
+            _circuit.update(state='open', opened_at=time.time())
+        if _circuit['state'] == 'open':
+            _circuit['retry_at'] = time.time() + CIRCUIT_RESET_TIMEOUT
+    if opening:
+        print(f'⚠️ [market_data] {CIRCUIT_FAILURE_THRESHOLD} upstream failures in a row, circuit opened')
+
+def circuit_state():
+    """'closed' или 'open'"""
+    return _circuit['state']
+
+def get_json(endpoint, params=None, bypass_circuit=False):
+    """GET {base_url}/api/v3/{endpoint} через общий пул; возвращает разобранный JSON.
+
+    Ошибки сети и HTTP - requests.exceptions.RequestException, некорректный JSON - ValueError.
+    Пока биржа недоступна (circuit open), сразу поднимает CircuitOpen.
+    """
+    if not bypass_circuit and not _allow_request():
+        raise CircuitOpen(f'Upstream unavailable, {endpoint} short-circuited')
+
+    if not _slots.acquire(timeout=MARKET_DATA_QUEUE_TIMEOUT):
+        _record(endpoint, None, 'busy')
+        raise UpstreamBusy(f'No free upstream slot for {endpoint}')
+
+    started = time.perf_counter()
+    try:
+        response = get_session().get(
+            f'{_base_url}/api/v3/{endpoint}', params=params,
+            timeout=ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        )
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        _record(endpoint, time.perf_counter() - started, f'{type(e).__name__}: {e}')
+        if _is_upstream_failure(e):
+            _on_failure()
+        else:
+            _on_success()
+        raise
+    finally:
+        _slots.release()
+
+    _record(endpoint, time.perf_counter() - started)
+    _on_success()
+    return data
+
+def probe():
+    """Проверка доступности биржи (/api/v3/ping) в обход breaker; True, если биржа отвечает"""
+    try:
+        get_json('ping', bypass_circuit=True)
+        return True
+    except (requests.exceptions.RequestException, ValueError):
+        return False
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+def get_metrics():
+    """Задержки (мс) и ошибки по эндпоинтам"""
+    with _metrics_lock:
+        snapshot = {endpoint: dict(stats, latencies=sorted(stats['latencies'])) for endpoint, stats in _metrics.items()}
+
+    result = {}
+    for endpoint, stats in snapshot.items():
+        latencies = stats['latencies']
+        result[endpoint] = {
+            'requests': stats['requests'],
+            'errors': stats['errors'],
+            'p50_ms': round(_percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+            'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+            'last_error': stats['last_error'],
+            'last_error_at': stats['last_error_at']
+        }
+    with _circuit_lock:
+        circuit = {key: _circuit[key] for key in ('state', 'failures', 'opened_at', 'retry_at')}
+    return {'base_url': _base_url, 'circuit': circuit, 'endpoints': result}
@@ -1,24 +1,197 @@
 import sqlite3
 import os
-import requests
+import threading
+import time
 from datetime import datetime
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'db.sqlite')
 
+# Сколько простаивающих соединений держит пул (лишние закрываются при возврате)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+# Сколько соединений может быть открыто одновременно (остальные ждут свободного)
+DB_POOL_MAX = max(int(os.environ.get('DB_POOL_MAX', '32')), DB_POOL_SIZE)
+# Сколько секунд ждать свободного соединения, прежде чем вернуть ошибку
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+# Сколько миллисекунд ждать снятия блокировки БД вместо "database is locked"
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+# Размер memory-mapped I/O в байтах (0 - отключить)
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+# Размер кэша подготовленных выражений на соединение
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', '256'))
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Свободное соединение не появилось за DB_POOL_TIMEOUT секунд"""
+    pass
+
+class PooledConnection:
+    """Соединение из пула: close() возвращает его в пул вместо закрытия"""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, '_conn', None)
+            self._pool.release(conn)
+
+    def __del__(self):
+        # Соединение, которое забыли закрыть, тоже возвращаем в пул
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class ConnectionPool:
+    """Пул SQLite соединений для потоков и greenlet'ов"""
+
+    def __init__(self, path, size, max_size, timeout):
+        self.path = path
+        self.size = size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        # Освобождение соединения будит одного из ожидающих
+        self._available = threading.Condition(self._lock)
+        self._in_use = 0
+        self._created = 0
+        self._reused = 0
+        self._discarded = 0
+        self._waiting = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        """Открыть соединение и один раз настроить его"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        # В режиме WAL NORMAL безопасен при сбое приложения и не делает fsync на каждый commit
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        return conn
+
+    def _wait_available(self):
+        """Дождаться, пока открытых соединений станет меньше max_size (под self._lock)"""
+        self._waits += 1
+        self._waiting += 1
+        started = time.monotonic()
+        deadline = started + self.timeout
+        try:
+            while self._in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f'No free database connection in {self.timeout:g}s ({self.max_size} in use)')
+                self._available.wait(remaining)
+        finally:
+            self._waiting -= 1
+            self._wait_time += time.monotonic() - started
+
+    def acquire(self):
+        """Взять соединение из пула (или открыть новое, если свободных нет).
+        
+        Открытых соединений не больше max_size: сверх этого ждем освобождения
+        не дольше timeout секунд, затем PoolTimeout.
+        """
+        with self._lock:
+            if self._in_use >= self.max_size:
+                self._wait_available()
+            conn = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            if conn is not None:
+                self._reused += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._in_use -= 1
+                    self._available.notify()
+                raise
+            with self._lock:
+                self._created += 1
+        conn.row_factory = sqlite3.Row
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Вернуть соединение в пул; незавершенная транзакция откатывается"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Соединение сломано - не возвращаем его в пул
+            with self._lock:
+                self._in_use -= 1
+                self._discarded += 1
+                self._available.notify()
+            conn.close()
+            return
+
+        with self._lock:
+            self._in_use -= 1
+            self._available.notify()
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._discarded += 1
+        conn.close()
+
+    def stats(self):
+        """Статистика пула"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'created': self._created,
+                'reused': self._reused,
+                'discarded': self._discarded,
+                'waiting': self._waiting,
+                'waits': self._waits,
+                'wait_ms': round(self._wait_time * 1000, 1),
+                'timeouts': self._timeouts
+            }
+
+_pool = ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_MAX, DB_POOL_TIMEOUT)
+
 def get_db():
-    """Получить соединение с БД"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Получить соединение с БД (из пула; close() возвращает его обратно)"""
+    return _pool.acquire()
 
-def init_db():
-    """Инициализация базы данных"""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Создание таблиц
+def get_pool_stats():
+    """Статистика пула соединений с БД"""
+    return _pool.stats()
+
+def table_columns(cursor, table):
+    """Имена колонок таблицы"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1] for row in cursor.fetchall()}
+
+def migration_base_schema(cursor):
+    """1: таблицы, аккаунты и перенос старых данных (для БД, созданных до версионирования)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -71,6 +244,21 @@ def init_db():
         )
     ''')
     
+    # Локальное хранилище свечей (open_time - Unix timestamp в секундах)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS candles (
+            symbol TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            open_time INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (symbol, timeframe, open_time)
+        ) WITHOUT ROWID
+    ''')
+    
     # Создание таблицы accounts для демо и реального аккаунтов
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS accounts (
@@ -84,18 +272,154 @@ def init_db():
         )
     ''')
     
-    # Добавление поля account_id в таблицу rounds (если его еще нет)
-    try:
-        cursor.execute('ALTER TABLE rounds ADD COLUMN account_id INTEGER')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rounds_account_id ON rounds(account_id)')
-    except sqlite3.OperationalError:
-        # Поле уже существует или индекс уже создан
-        pass
+    # Последняя запись журнала баланса, уже перенесенная в accounts (см. account_ledger)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+    ''')
     
-    conn.commit()
+    # Поле account_id в таблице rounds (в старых БД его нет)
+    if 'account_id' not in table_columns(cursor, 'rounds'):
+        cursor.execute('ALTER TABLE rounds ADD COLUMN account_id INTEGER')
     
     # Миграция данных: создание аккаунтов и перенос существующих данных
-    migrate_to_accounts(cursor, conn)
+    migrate_to_accounts(cursor)
+    
+    # Счетчик завершенных раундов аккаунта (ведется при завершении раунда, вместо COUNT(*) в истории)
+    if 'finished_rounds' not in table_columns(cursor, 'accounts'):
+        cursor.execute('ALTER TABLE accounts ADD COLUMN finished_rounds INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('''
+            UPDATE accounts SET finished_rounds = (
+                SELECT COUNT(*) FROM rounds r WHERE r.account_id = accounts.id AND r.status = 'finished'
+            )
+        ''')
+    
+    # Удаляем AAPL, если он есть (он не должен быть в списке Binance)
+    cursor.execute('DELETE FROM trading_pairs WHERE symbol = ?', ('AAPL',))
+    if cursor.rowcount > 0:
+        print('Removed AAPL pair from database')
+
+def migration_hot_path_indexes(cursor):
+    """2: индексы под запросы активных раундов, истории и завершения раундов"""
+    # (account_id, status, end_time) покрывает и старый индекс по account_id, и idx_rounds_history:
+    # rowid (id) неявно идет последним ключом, поэтому сортировка (end_time, id) тоже по индексу
+    cursor.execute('DROP INDEX IF EXISTS idx_rounds_account_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_rounds_history')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rounds_account_status_end ON rounds(account_id, status, end_time)')
+    # Поиск истекших раундов при завершении и загрузка расписания
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rounds_status_end ON rounds(status, end_time)')
+    
+    # У раунда один результат: дубли (от старой гонки завершения клиентом и сервером) удаляем,
+    # оставляя первый записанный
+    cursor.execute('''
+        DELETE FROM round_results
+        WHERE id NOT IN (SELECT MIN(id) FROM round_results GROUP BY round_id)
+    ''')
+    if cursor.rowcount > 0:
+        print(f'Removed {cursor.rowcount} duplicate round result(s)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_round_results_round_id ON round_results(round_id)')
+
+def migration_epoch_ms_times(cursor):
+    """3: start_time/end_time раундов - целые миллисекунды Unix вместо строк datetime"""
+    # Строки записаны из datetime.utcnow(), julianday разбирает их как UTC
+    for column in ('start_time', 'end_time'):
+        cursor.execute(f'''
+            UPDATE rounds
+            SET {column} = CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER)
+            WHERE typeof({column}) = 'text' AND julianday({column}) IS NOT NULL
+        ''')
+        if cursor.rowcount > 0:
+            print(f'Converted {column} of {cursor.rowcount} round(s) to epoch ms')
+
+def migration_account_daily_stats(cursor):
+    """4: сводная статистика по (аккаунт, день UTC, пара), заполняется из уже завершенных раундов"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS account_daily_stats (
+            account_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            pair_id INTEGER NOT NULL,
+            rounds INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            volume REAL NOT NULL DEFAULT 0,
+            pnl REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, day, pair_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO account_daily_stats (account_id, day, pair_id, rounds, wins, volume, pnl)
+        SELECT r.account_id, date(r.end_time / 1000, 'unixepoch'), r.pair_id,
+               COUNT(*), SUM(CASE WHEN rr.win THEN 1 ELSE 0 END), SUM(r.amount), SUM(rr.profit)
+        FROM rounds r
+        JOIN round_results rr ON rr.round_id = r.id
+        WHERE r.status = 'finished' AND r.account_id IS NOT NULL
+        GROUP BY r.account_id, date(r.end_time / 1000, 'unixepoch'), r.pair_id
+    ''')
+
+def migration_round_credit_flags(cursor):
+    """5: отметка, что выигрыш раунда уже перенесен в accounts (сверка журнала баланса при старте)"""
+    if 'credited' not in table_columns(cursor, 'round_results'):
+        cursor.execute('ALTER TABLE round_results ADD COLUMN credited INTEGER NOT NULL DEFAULT 0')
+    # Раунды, завершенные до этой версии, уже оплачены (после штатной остановки журнал перенесен в БД)
+    cursor.execute('UPDATE round_results SET credited = 1')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_round_results_uncredited ON round_results(round_id) WHERE win AND credited = 0')
+
+def migration_drop_derived_candles(cursor):
+    """6: удалить агрегированные свечи (5m, 15m, 1h...), которые раньше сохранялись в candles.
+
+    Сейчас хранится только базовый 1m ряд, остальные таймфреймы собираются из него в памяти;
+    старые строки других таймфреймов никто не читает и не чистит.
+    """
+    cursor.execute("DELETE FROM candles WHERE timeframe != '1m'")
+    if cursor.rowcount > 0:
+        print(f'Removed {cursor.rowcount} derived candle(s)')
+
+# Шаги схемы по порядку: шаг i переводит БД с версии i в i + 1 (PRAGMA user_version).
+# Выполненные шаги не меняются - изменения схемы добавляются новым шагом в конец
+MIGRATIONS = [
+    migration_base_schema,
+    migration_hot_path_indexes,
+    migration_epoch_ms_times,
+    migration_account_daily_stats,
+    migration_round_credit_flags,
+    migration_drop_derived_candles,
+]
+
+def migrate(conn):
+    """Применить недостающие шаги схемы (каждый - одной транзакцией); возвращает число шагов"""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    
+    applied = 0
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            step(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f'🗄️ [migrate] Schema migrated to version {number} ({step.__name__})')
+        applied += 1
+    
+    if applied:
+        # Статистика для планировщика запросов по новым индексам
+        cursor.execute('ANALYZE')
+        conn.commit()
+    return applied
+
+def init_db():
+    """Инициализация базы данных"""
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Схема: применяются только шаги новее версии БД
+    migrate(conn)
     
     # Инициализация данных
     cursor.execute('SELECT COUNT(*) FROM users')
@@ -109,12 +433,6 @@ def init_db():
         load_pairs_from_binance(cursor)
         conn.commit()
     
-    # Удаляем AAPL, если он есть (он не должен быть в списке Binance)
-    cursor.execute('DELETE FROM trading_pairs WHERE symbol = ?', ('AAPL',))
-    if cursor.rowcount > 0:
-        conn.commit()
-        print('Removed AAPL pair from database')
-    
     # Инициализация settings
     cursor.execute('SELECT COUNT(*) FROM settings WHERE key = ?', ('win_rate',))
     if cursor.fetchone()[0] == 0:
@@ -127,10 +445,8 @@ def load_pairs_from_binance(cursor):
     """Загрузить торговые пары с Binance API"""
     try:
         # Получаем все торговые пары с Binance
-        url = 'https://api.binance.com/api/v3/exchangeInfo'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        from market_data import get_json
+        data = get_json('exchangeInfo')
         
         # Фильтруем только USDT пары и популярные криптовалюты
         popular_symbols = ['BTC', 'ETH', 'BNB', 'SOL', 'ADA', 'XRP', 'DOT', 'DOGE', 'MATIC', 'AVAX', 'LINK', 'UNI', 'LTC', 'ATOM', 'ETC']
@@ -232,7 +548,7 @@ def format_pair_name(base_asset):
     }
     return names.get(base_asset, base_asset)
 
-def migrate_to_accounts(cursor, conn):
+def migrate_to_accounts(cursor):
     """Миграция существующих данных в систему аккаунтов"""
     # Проверяем, есть ли уже аккаунты
     cursor.execute('SELECT COUNT(*) FROM accounts')
@@ -266,8 +582,6 @@ def migrate_to_accounts(cursor, conn):
             ''', (demo_account_id, user_id))
             
             print(f'Created accounts for user {user_id}: demo (id={demo_account_id}), real (id={real_account_id})')
-        
-        conn.commit()
 
 def get_or_create_accounts(user_id=1):
     """Получить или создать аккаунты для пользователя"""
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from models import get_db
+
+# Снимок таблицы trading_pairs в памяти. Таблица меняется только через POST /pairs и
+# /pairs/sync, которые перезагружают снимок; снимок заменяется целиком, чтение без блокировки
+_registry = None
+# Версия снимка (для ETag GET /pairs): от времени загрузки в мс, растет при каждой перезагрузке
+_version = 0
+_lock = threading.Lock()
+
+def load_pairs():
+    """Загрузить все пары из БД в реестр (при старте и после изменения таблицы)"""
+    global _registry, _version
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, symbol, name, active FROM trading_pairs ORDER BY id')
+    pairs = [
+        {'id': row[0], 'symbol': row[1], 'name': row[2], 'active': bool(row[3])}
+        for row in cursor.fetchall()
+    ]
+    conn.close()
+
+    registry = {
+        'by_id': {pair['id']: pair for pair in pairs},
+        'by_symbol': {pair['symbol']: pair for pair in pairs},
+        'active': [pair for pair in pairs if pair['active']]
+    }
+    with _lock:
+        _registry = registry
+        _version = max(_version + 1, int(time.time() * 1000))
+    return registry
+
+def _get_registry():
+    registry = _registry
+    return registry if registry is not None else load_pairs()
+
+def get_pair(pair_id):
+    """Пара по id ({'id', 'symbol', 'name', 'active'}) или None. Словарь общий - не изменять.
+
+    id может прийти строкой из JSON ("1") - приводим к int, как это делал SQLite в WHERE id = ?
+    """
+    try:
+        pair_id = int(pair_id)
+    except (TypeError, ValueError):
+        return None
+    return _get_registry()['by_id'].get(pair_id)
+
+def get_pair_by_symbol(symbol):
+    """Пара по символу или None"""
+    return _get_registry()['by_symbol'].get(symbol)
+
+def get_symbol(pair_id):
+    """Символ пары или None"""
+    pair = get_pair(pair_id)
+    return pair['symbol'] if pair else None
+
+def get_active_pairs():
+    """Активные пары в порядке id"""
+    return _get_registry()['active']
+
+def get_pairs_version():
+    """Текущая версия реестра (для ETag)"""
+    if _registry is None:
+        load_pairs()
+    return _version
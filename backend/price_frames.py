@@ -0,0 +1,88 @@
+import os
+import threading
+
+# Как часто собирается кадр prices_batch (секунды)
+PRICE_BATCH_INTERVAL = float(os.environ.get('PRICE_BATCH_INTERVAL', '2'))
+
+# Раз в сколько секунд вместо изменений отправляется полный снимок цен (для ресинхронизации)
+PRICE_SNAPSHOT_INTERVAL = float(os.environ.get('PRICE_SNAPSHOT_INTERVAL', '30'))
+
+# Минимальное относительное изменение цены, которое попадает в кадр (0 - любое изменение)
+PRICE_DELTA_THRESHOLD = float(os.environ.get('PRICE_DELTA_THRESHOLD', '0'))
+
+def _parse_thresholds(value):
+    """'BTCUSDT=0.0001,EURUSD=0.00005' -> {symbol: порог}"""
+    thresholds = {}
+    for item in (value or '').split(','):
+        symbol, _, threshold = item.partition('=')
+        if symbol.strip() and threshold.strip():
+            thresholds[symbol.strip()] = float(threshold)
+    return thresholds
+
+# Пороги для отдельных символов (перекрывают PRICE_DELTA_THRESHOLD)
+PRICE_DELTA_THRESHOLDS = _parse_thresholds(os.environ.get('PRICE_DELTA_THRESHOLDS'))
+
+# Последняя отправленная цена по паре: pair_id -> price
+_last_sent = {}
+_seq = 0
+_lock = threading.Lock()
+
+def threshold_for(symbol):
+    """Порог относительного изменения цены для символа"""
+    return PRICE_DELTA_THRESHOLDS.get(symbol, PRICE_DELTA_THRESHOLD)
+
+def _is_changed(symbol, price, last):
+    if last is None:
+        return True
+    threshold = threshold_for(symbol)
+    if threshold <= 0 or not last:
+        return price != last
+    return abs(price - last) / abs(last) >= threshold
+
+def changed_prices(prices):
+    """Из {pair_id: (symbol, price)} оставить пары, цена которых сдвинулась больше порога.
+
+    Отправленные цены запоминаются: следующий кадр сравнивается с ними, а не с прошлым тиком,
+    поэтому медленный дрейф ниже порога за тик все равно рано или поздно попадет в кадр.
+    """
+    changed = {}
+    with _lock:
+        for pair_id, (symbol, price) in prices.items():
+            if _is_changed(symbol, price, _last_sent.get(pair_id)):
+                changed[pair_id] = price
+                _last_sent[pair_id] = price
+    return changed
+
+def mark_sent(prices):
+    """Запомнить цены, отправленные полным снимком"""
+    with _lock:
+        _last_sent.update(prices)
+
+def forget(pair_ids):
+    """Забыть цены пар, на которые больше никто не подписан"""
+    with _lock:
+        for pair_id in pair_ids:
+            _last_sent.pop(pair_id, None)
+
+def tracked_pairs():
+    """Пары, для которых помним последнюю отправленную цену"""
+    return list(_last_sent)
+
+def next_seq():
+    """Номер следующего кадра (растет монотонно в пределах процесса)"""
+    global _seq
+    with _lock:
+        _seq += 1
+        return _seq
+
+def current_seq():
+    return _seq
+
+def build_frame(seq, prices, full, timestamp):
+    """Кадр prices_batch: {seq, full, timestamp, prices: {pair_id: price}}"""
+    return {
+        'seq': seq,
+        'full': full,
+        'timestamp': timestamp,
+        'prices': {str(pair_id): price for pair_id, price in prices.items()}
+    }
@@ -0,0 +1,60 @@
+import math
+import os
+import random
+import threading
+import time
+
+# Модель цены, когда реальной нет (биржа недоступна или пара не торгуется на Binance):
+# цена продолжает движение от последней известной, без скачков между вызовами
+
+# Волатильность за секунду (стандартное отклонение лог-изменения за 1 с)
+PRICE_MODEL_VOLATILITY = float(os.environ.get('PRICE_MODEL_VOLATILITY', '0.0002'))
+# Скорость возврата к последней реальной цене (доля расхождения за секунду)
+PRICE_MODEL_REVERSION = float(os.environ.get('PRICE_MODEL_REVERSION', '0.001'))
+# Шаг не длиннее этого (секунды): после долгого простоя цена не прыгает
+MAX_STEP_SECONDS = 60.0
+
+# Базовые цены символов, для которых реальной цены еще не было
+BASE_PRICES = {
+    'BTCUSDT': 65000.0,
+    'ETHUSDT': 3500.0,
+    'BNBUSDT': 600.0,
+    'SOLUSDT': 150.0,
+    'ADAUSDT': 0.5
+}
+DEFAULT_BASE_PRICE = 100.0
+
+# symbol -> {'price', 'timestamp', 'anchor'}; anchor - последняя реальная цена (или базовая)
+_states = {}
+_lock = threading.Lock()
+
+def observe(symbol, price, timestamp=None):
+    """Запомнить реальную цену: модель продолжит от нее"""
+    timestamp = timestamp or time.time()
+    with _lock:
+        _states[symbol] = {'price': price, 'timestamp': timestamp, 'anchor': price}
+
+def next_price(symbol, now=None):
+    """Следующая цена модели: шаг случайного блуждания длиной в прошедшее время"""
+    now = now or time.time()
+    with _lock:
+        state = _states.get(symbol)
+        if state is None:
+            base = BASE_PRICES.get(symbol, DEFAULT_BASE_PRICE)
+            state = _states[symbol] = {'price': base, 'timestamp': now, 'anchor': base}
+            return base
+
+        dt = min(max(now - state['timestamp'], 0.0), MAX_STEP_SECONDS)
+        if dt == 0:
+            return state['price']
+
+        # Лог-цена: возврат к якорю + шум, масштабированный на sqrt(dt)
+        level = math.log(state['price'])
+        anchor = math.log(state['anchor'])
+        reversion = 1 - math.exp(-PRICE_MODEL_REVERSION * dt)
+        level += (anchor - level) * reversion + random.gauss(0.0, PRICE_MODEL_VOLATILITY * math.sqrt(dt))
+
+        price = math.exp(level)
+        state['price'] = price
+        state['timestamp'] = now
+        return price
@@ -0,0 +1,99 @@
+import heapq
+import os
+import threading
+import time
+
+from app import socketio, app
+from models import get_db
+from trading_logic import check_and_finish_rounds
+
+# Раз в сколько секунд перечитывать активные раунды из БД, даже если куча пуста
+# (страховка от раундов, созданных в обход schedule_round)
+SCHEDULER_RESYNC_INTERVAL = float(os.environ.get('SCHEDULER_RESYNC_INTERVAL', '60'))
+
+# Небольшой запас, чтобы при пробуждении end_time в БД гарантированно был <= now
+SETTLE_GRACE = 0.005
+
+# Min-куча (end_timestamp, round_id) активных раундов
+_heap = []
+_scheduled = set()
+_lock = threading.Lock()
+_wakeup = None
+
+def schedule_round(round_id, end_ts):
+    """Добавить раунд в расписание завершения (end_ts - Unix timestamp в секундах)"""
+    with _lock:
+        if round_id in _scheduled:
+            return
+        _scheduled.add(round_id)
+        heapq.heappush(_heap, (end_ts, round_id))
+        is_next = _heap[0][1] == round_id
+    # Новый раунд завершается раньше всех - будим планировщик, чтобы он пересчитал сон
+    if is_next and _wakeup is not None:
+        _wakeup.set()
+
+def load_active_rounds():
+    """Загрузить все активные раунды из БД в расписание"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, end_time FROM rounds WHERE status = 'active'")
+    rows = cursor.fetchall()
+    conn.close()
+
+    for round_id, end_time in rows:
+        # end_time в БД - миллисекунды Unix
+        try:
+            schedule_round(round_id, end_time / 1000)
+        except TypeError as e:
+            print(f'❌ [round_scheduler] Bad end_time for round {round_id}: {end_time} ({e})')
+    return len(rows)
+
+def _pop_due_rounds(now):
+    """Снять с кучи все раунды, время которых наступило; возвращает [(end_ts, round_id)]"""
+    due = []
+    with _lock:
+        while _heap and _heap[0][0] + SETTLE_GRACE <= now:
+            end_ts, round_id = heapq.heappop(_heap)
+            _scheduled.discard(round_id)
+            due.append((end_ts, round_id))
+    return due
+
+def run_round_scheduler():
+    """Фоновая задача: спит ровно до ближайшего end_time и завершает раунды"""
+    global _wakeup
+    _wakeup = socketio.server.eio.create_event()
+
+    count = load_active_rounds()
+    print(f'⏱️ [round_scheduler] Loaded {count} active round(s)')
+    last_resync = time.time()
+
+    while True:
+        due = []
+        try:
+            # Сбрасываем флаг до расчета сна: schedule_round после этого момента разбудит wait()
+            _wakeup.clear()
+            now = time.time()
+            due = _pop_due_rounds(now)
+            if due:
+                with app.app_context():
+                    check_and_finish_rounds(socketio, app)
+                continue
+
+            if now - last_resync >= SCHEDULER_RESYNC_INTERVAL:
+                load_active_rounds()
+                last_resync = now
+
+            with _lock:
+                next_due = _heap[0][0] + SETTLE_GRACE if _heap else None
+            timeout = SCHEDULER_RESYNC_INTERVAL if next_due is None else min(next_due - now, SCHEDULER_RESYNC_INTERVAL)
+
+            _wakeup.wait(max(timeout, 0))
+        except Exception as e:
+            print(f'❌ Error in round scheduler: {e}')
+            import traceback
+            traceback.print_exc()
+            # Завершение не прошло - возвращаем снятые раунды в кучу, чтобы повторить
+            # через секунду, а не ждать следующей сверки с БД
+            for end_ts, round_id in due:
+                schedule_round(round_id, end_ts)
+            socketio.sleep(1)
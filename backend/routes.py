@@ -1,21 +1,35 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from models import get_db
-from datetime import datetime, timedelta
-import random
+from datetime import datetime, timezone
+import base64
+import csv
+import io
+import os
+import json
 import sqlite3
-import requests
-from utils import get_current_price
+import time
+from utils import get_current_price, get_active_pair_prices
+from settings_cache import get_setting, set_setting, get_settings_version
+from pair_registry import load_pairs, get_pair, get_symbol, get_active_pairs, get_pairs_version
+from http_cache import versioned, cached, compress_response
+from json_provider import dumps_bytes
+from trading_logic import record_round_stats
+import account_ledger
+from account_ledger import find_account, InsufficientFunds
 
 api = Blueprint('api', __name__)
 
+# Большие ответы API (свечи, списки) сжимаются gzip/brotli
+api.after_request(compress_response)
+
+# Сколько раундов истории можно запросить за одну страницу
+HISTORY_MAX_LIMIT = 100
+
 @api.route('/pairs', methods=['GET'])
+@versioned(get_pairs_version, 'pairs', 'public, no-cache')
 def get_pairs():
-    """Получить список торговых пар"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, symbol, name FROM trading_pairs WHERE active = 1')
-    pairs = [{'id': row[0], 'symbol': row[1], 'name': row[2]} for row in cursor.fetchall()]
-    conn.close()
+    """Получить список торговых пар (из реестра пар, с ETag по его версии)"""
+    pairs = [{'id': pair['id'], 'symbol': pair['symbol'], 'name': pair['name']} for pair in get_active_pairs()]
     return jsonify(pairs)
 
 @api.route('/pairs', methods=['POST'])
@@ -35,6 +49,8 @@ def add_pair():
         conn.commit()
         pair_id = cursor.lastrowid
         conn.close()
+        # Таблица пар изменилась - перечитываем реестр (новая версия инвалидирует ETag)
+        load_pairs()
         return jsonify({'id': pair_id, 'symbol': symbol, 'name': name}), 201
     except sqlite3.IntegrityError:
         conn.close()
@@ -68,6 +84,7 @@ def sync_pairs():
         pairs = [{'id': row[0], 'symbol': row[1], 'name': row[2]} for row in cursor.fetchall()]
         
         conn.close()
+        load_pairs()
         
         return jsonify({
             'message': 'Pairs synchronized successfully',
@@ -81,29 +98,15 @@ def sync_pairs():
 
 @api.route('/balance', methods=['GET'])
 def get_balance():
-    """Получить баланс аккаунта"""
+    """Получить баланс аккаунта (из журнала баланса в памяти)"""
     account_id = request.args.get('account_id', type=int)
     account_type = request.args.get('account_type')  # 'demo' или 'real'
     user_id = request.args.get('user_id', 1, type=int)
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    if account_id:
-        # Если передан account_id, используем его
-        cursor.execute('SELECT balance FROM accounts WHERE id = ? AND user_id = ?', (account_id, user_id))
-    elif account_type:
-        # Если передан account_type, ищем аккаунт по типу
-        cursor.execute('SELECT balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, account_type))
-    else:
-        # По умолчанию возвращаем demo аккаунт
-        cursor.execute('SELECT balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, 'demo'))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return jsonify({'balance': row[0]})
+    # Без account_id и account_type возвращаем demo аккаунт
+    account = find_account(user_id, account_id, account_type or 'demo')
+    if account:
+        return jsonify({'balance': account['balance']})
     return jsonify({'error': 'Account not found'}), 404
 
 @api.route('/rounds', methods=['POST'])
@@ -124,55 +127,67 @@ def create_round():
     if direction not in ['BUY', 'SELL']:
         return jsonify({'error': 'Direction must be BUY or SELL'}), 400
     
-    # Получаем account_id
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    if account_id:
-        cursor.execute('SELECT id, balance FROM accounts WHERE id = ? AND user_id = ?', (account_id, user_id))
-    elif account_type:
-        cursor.execute('SELECT id, balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, account_type))
-    else:
-        # По умолчанию используем demo аккаунт
-        cursor.execute('SELECT id, balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, 'demo'))
+    # pair_id может прийти строкой ("1"): в раунд пишем id из реестра, неизвестную пару не принимаем
+    pair = get_pair(pair_id)
+    if pair is None:
+        return jsonify({'error': 'Unknown pair_id'}), 400
+    pair_id = pair['id']
     
-    account = cursor.fetchone()
+    # По умолчанию используем demo аккаунт
+    account = find_account(user_id, account_id, account_type or 'demo')
     if not account:
-        conn.close()
         return jsonify({'error': 'Account not found'}), 404
+    account_id = account['id']
     
-    account_id = account[0]
-    account_balance = account[1]
-    
-    if account_balance < amount:
-        conn.close()
+    # Быстрый отказ до запроса цены; окончательная проверка - при списании ниже
+    if account['balance'] < amount:
         return jsonify({'error': 'Insufficient balance'}), 400
     
-    # Создание раунда
-    start_time = datetime.utcnow()
-    end_time = start_time + timedelta(seconds=duration)
+    # Создание раунда (время - миллисекунды Unix)
+    start_time = int(time.time() * 1000)
+    end_time = start_time + int(duration * 1000)
     
-    # Получаем текущую цену (симулированную)
+    # Получаем текущую цену (симулированную) - до транзакции, чтобы не держать блокировку записи
     start_price = get_current_price(pair_id)
     
-    cursor.execute('''
-        INSERT INTO rounds (user_id, account_id, pair_id, direction, amount, duration, start_time, end_time, start_price)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, account_id, pair_id, direction, amount, duration, start_time, end_time, start_price))
-    
-    round_id = cursor.lastrowid
-    
-    # Списываем сумму со счета аккаунта
-    cursor.execute('UPDATE accounts SET balance = balance - ? WHERE id = ?', (amount, account_id))
+    # Раунд и списание ставки - вместе: строка раунда вставляется в транзакции, ставка
+    # списывается в журнале баланса с id раунда до коммита. Проверка и списание - одна
+    # атомарная операция, поэтому параллельные раунды одного аккаунта не уходят в минус.
+    # При восстановлении запись ставки применяется, только если раунд есть в БД
+    conn = get_db()
+    cursor = conn.cursor()
+    with account_ledger.round_transaction():
+        try:
+            cursor.execute('''
+                INSERT INTO rounds (user_id, account_id, pair_id, direction, amount, duration, start_time, end_time, start_price)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, account_id, pair_id, direction, amount, duration, start_time, end_time, start_price))
+            round_id = cursor.lastrowid
+            account_ledger.debit(account_id, amount, 'round_stake', round_id)
+        except InsufficientFunds:
+            conn.rollback()
+            conn.close()
+            return jsonify({'error': 'Insufficient balance'}), 400
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        try:
+            conn.commit()
+        except Exception:
+            # Раунд не создан - возвращаем ставку
+            account_ledger.credit(account_id, amount, 'round_stake_refund', round_id)
+            raise
+        finally:
+            conn.close()
     
-    # Получаем информацию о паре для ответа
-    cursor.execute('SELECT symbol, name FROM trading_pairs WHERE id = ?', (pair_id,))
-    pair_info = cursor.fetchone()
-    pair_symbol = pair_info[0] if pair_info else 'BTCUSDT'
-    pair_name = pair_info[1] if pair_info else 'Unknown'
+    # Информация о паре для ответа (пара проверена выше)
+    pair_symbol = pair['symbol']
+    pair_name = pair['name']
     
-    conn.commit()
-    conn.close()
+    # Ставим раунд в расписание серверного завершения
+    from round_scheduler import schedule_round
+    schedule_round(round_id, end_time / 1000)
     
     return jsonify({
         'id': round_id,
@@ -181,8 +196,8 @@ def create_round():
         'direction': direction,
         'amount': amount,
         'duration': duration,
-        'start_time': start_time.isoformat(),
-        'end_time': end_time.isoformat(),
+        'start_time': start_time,
+        'end_time': end_time,
         'start_price': start_price,
         'symbol': pair_symbol,
         'name': pair_name,
@@ -233,36 +248,14 @@ def get_active_rounds():
     
     rounds = []
     for row in cursor.fetchall():
-        # Конвертируем end_time в Unix timestamp (миллисекунды) для единообразия
-        end_time = row[6]
-        if end_time:
-            if isinstance(end_time, str):
-                # Если строка, парсим в datetime
-                from datetime import datetime
-                try:
-                    end_time_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                except:
-                    try:
-                        end_time_dt = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S.%f')
-                    except:
-                        end_time_dt = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S')
-                end_time_ms = int(end_time_dt.timestamp() * 1000)
-            elif hasattr(end_time, 'timestamp'):
-                # Если datetime объект
-                end_time_ms = int(end_time.timestamp() * 1000)
-            else:
-                end_time_ms = end_time
-        else:
-            end_time_ms = None
-        
         rounds.append({
             'id': row[0],
             'pair_id': row[1],
             'direction': row[2],
             'amount': row[3],
             'duration': row[4],
-            'start_time': row[5],
-            'end_time': end_time_ms,  # Возвращаем Unix timestamp в миллисекундах
+            'start_time': row[5],  # Unix timestamp в миллисекундах
+            'end_time': row[6],
             'start_price': row[7],
             'symbol': row[8],
             'name': row[9]
@@ -271,44 +264,65 @@ def get_active_rounds():
     conn.close()
     return jsonify(rounds)
 
+def encode_history_cursor(end_time, round_id):
+    """Курсор истории: позиция (end_time, id) последнего раунда страницы"""
+    return base64.urlsafe_b64encode(json.dumps([end_time, round_id]).encode()).decode()
+
+def decode_history_cursor(value):
+    """Позиция (end_time, id) из курсора или None, если курсор испорчен"""
+    try:
+        end_time, round_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return end_time, int(round_id)
+    except (ValueError, TypeError):
+        return None
+
 @api.route('/rounds/history', methods=['GET'])
 def get_rounds_history():
-    """Получить историю завершенных раундов аккаунта"""
+    """Получить историю завершенных раундов аккаунта.
+    
+    Страницы листаются по курсору (?cursor= из next_cursor предыдущей страницы): запрос идет
+    по индексу с позиции (end_time, id), поэтому дальние страницы стоят столько же, сколько первая.
+    Без курсора работает старый ?page= (через OFFSET).
+    """
     account_id = request.args.get('account_id', type=int)
     account_type = request.args.get('account_type')
     user_id = request.args.get('user_id', 1, type=int)
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 20, type=int)
-    offset = (page - 1) * limit
+    page = request.args.get('page', '1')
+    limit = request.args.get('limit', '20')
+    cursor_param = request.args.get('cursor')
     
-    conn = get_db()
-    cursor = conn.cursor()
+    # Пустая или отрицательная страница дошла бы до next_cursor по rows[-1] (500) - проверяем заранее
+    try:
+        page = int(page)
+        limit = int(limit)
+    except ValueError:
+        return jsonify({'error': 'page and limit must be integers'}), 400
+    if page < 1 or not 1 <= limit <= HISTORY_MAX_LIMIT:
+        return jsonify({'error': f'page must be >= 1 and limit between 1 and {HISTORY_MAX_LIMIT}'}), 400
     
     # Определяем account_id
     if account_id:
-        cursor.execute('SELECT id FROM accounts WHERE id = ? AND user_id = ?', (account_id, user_id))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({'error': 'Account not found'}), 404
-        filter_account_id = account_id
-    elif account_type:
-        cursor.execute('SELECT id FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, account_type))
-        account = cursor.fetchone()
+        account = find_account(user_id, account_id)
         if not account:
-            conn.close()
-            return jsonify({'transactions': [], 'page': page, 'total_pages': 0})
-        filter_account_id = account[0]
+            return jsonify({'error': 'Account not found'}), 404
     else:
         # По умолчанию используем demo аккаунт
-        cursor.execute('SELECT id FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, 'demo'))
-        account = cursor.fetchone()
+        account = find_account(user_id, account_type=account_type or 'demo')
         if not account:
-            conn.close()
             return jsonify({'transactions': [], 'page': page, 'total_pages': 0})
-        filter_account_id = account[0]
+    filter_account_id = account['id']
+    
+    position = None
+    if cursor_param:
+        position = decode_history_cursor(cursor_param)
+        if position is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
     
     # Получаем завершенные раунды с результатами
-    cursor.execute('''
+    query = '''
         SELECT r.id, r.pair_id, r.direction, r.amount, r.duration, 
                r.start_time, r.end_time, r.start_price, 
                tp.symbol, tp.name,
@@ -317,58 +331,34 @@ def get_rounds_history():
         JOIN trading_pairs tp ON r.pair_id = tp.id
         LEFT JOIN round_results rr ON r.id = rr.round_id
         WHERE r.account_id = ? AND r.status = 'finished'
-        ORDER BY r.end_time DESC
-        LIMIT ? OFFSET ?
-    ''', (filter_account_id, limit, offset))
+    '''
+    if position is not None:
+        query += ' AND (r.end_time, r.id) < (?, ?) ORDER BY r.end_time DESC, r.id DESC LIMIT ?'
+        cursor.execute(query, (filter_account_id, position[0], position[1], limit))
+    else:
+        query += ' ORDER BY r.end_time DESC, r.id DESC LIMIT ? OFFSET ?'
+        cursor.execute(query, (filter_account_id, limit, (page - 1) * limit))
+    rows = cursor.fetchall()
+    
+    # Общее количество - из счетчика аккаунта (ведется при завершении раундов)
+    cursor.execute('SELECT finished_rounds FROM accounts WHERE id = ?', (filter_account_id,))
+    total_count = cursor.fetchone()[0]
+    conn.close()
+    
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_history_cursor(rows[-1][6], rows[-1][0])
     
     transactions = []
-    for row in cursor.fetchall():
-        # Конвертируем end_time в Unix timestamp (миллисекунды)
-        end_time = row[6]
-        if end_time:
-            if isinstance(end_time, str):
-                try:
-                    end_time_dt = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                except:
-                    try:
-                        end_time_dt = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S.%f')
-                    except:
-                        end_time_dt = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S')
-                end_time_ms = int(end_time_dt.timestamp() * 1000)
-            elif hasattr(end_time, 'timestamp'):
-                end_time_ms = int(end_time.timestamp() * 1000)
-            else:
-                end_time_ms = end_time
-        else:
-            end_time_ms = None
-        
-        # Конвертируем start_time в Unix timestamp (миллисекунды)
-        start_time = row[5]
-        if start_time:
-            if isinstance(start_time, str):
-                try:
-                    start_time_dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                except:
-                    try:
-                        start_time_dt = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S.%f')
-                    except:
-                        start_time_dt = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-                start_time_ms = int(start_time_dt.timestamp() * 1000)
-            elif hasattr(start_time, 'timestamp'):
-                start_time_ms = int(start_time.timestamp() * 1000)
-            else:
-                start_time_ms = start_time
-        else:
-            start_time_ms = None
-        
+    for row in rows:
         transactions.append({
             'id': row[0],
             'pair_id': row[1],
             'direction': row[2],
             'amount': float(row[3]),
             'duration': row[4],
-            'start_time': start_time_ms,
-            'end_time': end_time_ms,
+            'start_time': row[5],
+            'end_time': row[6],
             'start_price': float(row[7]) if row[7] else None,
             'symbol': row[8],
             'name': row[9],
@@ -377,24 +367,133 @@ def get_rounds_history():
             'end_price': float(row[12]) if row[12] else None
         })
     
-    # Получаем общее количество записей для пагинации
-    cursor.execute('''
-        SELECT COUNT(*) 
-        FROM rounds r
-        WHERE r.account_id = ? AND r.status = 'finished'
-    ''', (filter_account_id,))
-    total_count = cursor.fetchone()[0]
-    
-    conn.close()
-    
     return jsonify({
         'transactions': transactions,
         'page': page,
         'limit': limit,
         'total': total_count,
-        'total_pages': (total_count + limit - 1) // limit
+        'total_pages': (total_count + limit - 1) // limit,
+        'next_cursor': next_cursor
     })
 
+# Сколько строк выгрузки читать из БД за раз (память не зависит от размера истории)
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+
+EXPORT_COLUMNS = ['id', 'pair_id', 'symbol', 'direction', 'amount', 'duration', 'start_time',
+                  'end_time', 'start_price', 'end_price', 'win', 'profit']
+
+def parse_time_param(value):
+    """Граница периода: миллисекунды Unix или дата/время ISO (UTC) -> миллисекунды"""
+    if value is None or value == '':
+        return None
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1000)
+
+def iter_export_rows(account_id, time_from=None, time_to=None, pair_ids=None):
+    """Завершенные раунды аккаунта с результатами по end_time - пачками по EXPORT_BATCH_SIZE"""
+    query = '''
+        SELECT r.id, r.pair_id, tp.symbol, r.direction, r.amount, r.duration,
+               r.start_time, r.end_time, r.start_price, rr.end_price, rr.win, rr.profit
+        FROM rounds r
+        LEFT JOIN trading_pairs tp ON r.pair_id = tp.id
+        LEFT JOIN round_results rr ON r.id = rr.round_id
+        WHERE r.account_id = ? AND r.status = 'finished'
+    '''
+    params = [account_id]
+    if time_from is not None:
+        query += ' AND r.end_time >= ?'
+        params.append(time_from)
+    if time_to is not None:
+        query += ' AND r.end_time < ?'
+        params.append(time_to)
+    if pair_ids:
+        query += f' AND r.pair_id IN ({",".join("?" * len(pair_ids))})'
+        params.extend(pair_ids)
+    query += ' ORDER BY r.end_time, r.id'
+    
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def export_csv(batches):
+    """CSV с заголовком: один кусок ответа на пачку строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            tuple(row[:10]) + (None if row[10] is None else int(bool(row[10])), row[11])
+            for row in rows
+        )
+        yield buffer.getvalue()
+
+def export_ndjson(batches):
+    """NDJSON: объект раунда на строку"""
+    for rows in batches:
+        chunk = []
+        for row in rows:
+            item = dict(zip(EXPORT_COLUMNS, row))
+            if item['win'] is not None:
+                item['win'] = bool(item['win'])
+            chunk.append(dumps_bytes(item))
+        yield b'\n'.join(chunk) + b'\n'
+
+@api.route('/rounds/export', methods=['GET'])
+def export_rounds():
+    """Выгрузить всю историю раундов аккаунта потоком: ?format=csv|ndjson, from, to, pair_ids=1,2
+    
+    from/to - границы end_time (миллисекунды Unix или ISO дата, to не включается).
+    """
+    account_id = request.args.get('account_id', type=int)
+    account_type = request.args.get('account_type')
+    user_id = request.args.get('user_id', 1, type=int)
+    export_format = request.args.get('format', 'csv')
+    
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        time_from = parse_time_param(request.args.get('from'))
+        time_to = parse_time_param(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'from and to must be epoch milliseconds or ISO dates'}), 400
+    pair_ids = request.args.get('pair_ids')
+    if pair_ids:
+        try:
+            pair_ids = [int(pair_id) for pair_id in pair_ids.split(',') if pair_id.strip()]
+        except ValueError:
+            return jsonify({'error': 'pair_ids must be a comma-separated list of integers'}), 400
+    
+    # По умолчанию используем demo аккаунт
+    account = find_account(user_id, account_id, account_type or 'demo')
+    if not account:
+        return jsonify({'error': 'Account not found'}), 404
+    
+    batches = iter_export_rows(account['id'], time_from, time_to, pair_ids)
+    if export_format == 'csv':
+        body, mimetype = export_csv(batches), 'text/csv'
+    else:
+        body, mimetype = export_ndjson(batches), 'application/x-ndjson'
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=rounds_{account["id"]}.{export_format}'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @api.route('/rounds/<int:round_id>/finish', methods=['POST'])
 def finish_round(round_id):
     """Завершить раунд с результатом от клиента"""
@@ -426,7 +525,7 @@ def finish_round(round_id):
     
     # Получаем данные раунда
     cursor.execute('''
-        SELECT user_id, account_id, pair_id, amount, start_price
+        SELECT user_id, account_id, pair_id, amount, start_price, end_time
         FROM rounds
         WHERE id = ? AND status = 'active'
     ''', (round_id,))
@@ -442,14 +541,17 @@ def finish_round(round_id):
         conn.close()
         return jsonify({'error': 'Round not found or already finished'}), 404
     
-    user_id, account_id, pair_id, amount, start_price = round_data
+    user_id, account_id, pair_id, amount, start_price, end_time = round_data
+    
+    # Текущая цена для end_price - до первой записи, чтобы не держать блокировку записи
+    # на время запроса к бирже
+    end_price = get_current_price(pair_id)
     
     # Если account_id отсутствует (старые раунды), используем demo аккаунт
     if account_id is None:
-        cursor.execute('SELECT id FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, 'demo'))
-        demo_account = cursor.fetchone()
+        demo_account = find_account(user_id)
         if demo_account:
-            account_id = demo_account[0]
+            account_id = demo_account['id']
             # Обновляем раунд с account_id
             cursor.execute('UPDATE rounds SET account_id = ? WHERE id = ?', (account_id, round_id))
         else:
@@ -463,31 +565,42 @@ def finish_round(round_id):
     except: pass
     # #endregion
     
-    # Получаем текущую цену для end_price
-    from utils import get_current_price
-    end_price = get_current_price(pair_id)
-    
-    # Обновляем баланс аккаунта
-    if win:
-        # Выигрыш: возвращаем ставку + прибыль
-        new_balance_change = amount + profit
-        cursor.execute('UPDATE accounts SET balance = balance + ? WHERE id = ?', 
-                     (new_balance_change, account_id))
-    # Если проигрыш, баланс не меняется (ставка уже была списана при создании)
+    # Обновляем статус раунда (если его уже завершил сервер - выходим)
+    cursor.execute("UPDATE rounds SET status = 'finished' WHERE id = ? AND status = 'active'", 
+                  (round_id,))
+    if cursor.rowcount == 0:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': 'Round not found or already finished'}), 404
+    cursor.execute('UPDATE accounts SET finished_rounds = finished_rounds + 1 WHERE id = ?', (account_id,))
     
     # Сохраняем результат
     cursor.execute('''
         INSERT INTO round_results (round_id, win, profit, end_price)
         VALUES (?, ?, ?, ?)
     ''', (round_id, win, profit, end_price))
+    record_round_stats(cursor, [(account_id, end_time, pair_id, win, amount, profit)])
     
-    # Обновляем статус раунда
-    cursor.execute('UPDATE rounds SET status = ? WHERE id = ?', 
-                  ('finished', round_id))
-    
-    # Получаем новый баланс аккаунта
-    cursor.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,))
-    new_balance = cursor.fetchone()[0]
+    # Обновляем баланс аккаунта: выигрыш (ставка + прибыль) пишем в журнал с id раунда
+    # до коммита, как в check_and_finish_rounds. Если проигрыш, баланс не меняется
+    # (ставка уже была списана при создании)
+    with account_ledger.round_transaction():
+        if win:
+            try:
+                account_ledger.credit(account_id, amount + profit, 'round_win', round_id)
+            except Exception:
+                conn.rollback()
+                conn.close()
+                raise
+        try:
+            conn.commit()
+        except Exception:
+            if win:
+                account_ledger.credit(account_id, -(amount + profit), 'round_win_revert', round_id)
+            raise
+        finally:
+            conn.close()
+    new_balance = account_ledger.get_balance(account_id)
     
     # #region agent log
     try:
@@ -496,28 +609,43 @@ def finish_round(round_id):
     except: pass
     # #endregion
     
-    conn.commit()
-    conn.close()
-    
     return jsonify({
         'new_balance': new_balance,
         'round_id': round_id
     }), 200
 
 @api.route('/chart-data/<int:pair_id>', methods=['GET'])
+@cached('public, max-age=5')
 def get_chart_data(pair_id):
     """Получить данные для графика"""
+    from candle_aggregator import parse_timeframe, SUPPORTED_TIMEFRAMES
+    from candle_store import max_chart_limit
     timeframe = request.args.get('timeframe', '1m')
     limit = request.args.get('limit', 100, type=int)
     
     print(f'📊 [get_chart_data] Request for pair_id={pair_id}, timeframe={timeframe}, limit={limit}')
     
+    interval = parse_timeframe(timeframe)
+    if interval is None:
+        return jsonify({'error': f'Unsupported timeframe, expected one of: {", ".join(SUPPORTED_TIMEFRAMES)}'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    
+    # Не глубже хранимой 1m истории (interval * limit <= CANDLE_RETENTION минут) - и для
+    # реальных, и для модельных свечей; урезанный запрос отмечаем заголовком с пределом
+    max_limit = max_chart_limit(interval)
+    if limit > max_limit:
+        limit = max_limit
+        headers = {'X-Chart-Max-Limit': str(max_limit)}
+    else:
+        headers = {}
+    
     # Пробуем получить реальные данные, если не получится - используем симуляцию
     try:
         candles = get_real_chart_data(pair_id, timeframe, limit)
         if candles:
-            print(f'✅ [get_chart_data] Got {len(candles)} real candles from Binance for pair {pair_id}')
-            return jsonify(candles)
+            print(f'✅ [get_chart_data] Got {len(candles)} real candles from candle store for pair {pair_id}')
+            return jsonify(candles), 200, headers
         else:
             print(f'⚠️ [get_chart_data] No real data returned, using simulation')
     except Exception as e:
@@ -528,7 +656,7 @@ def get_chart_data(pair_id):
     # Генерируем симулированные данные свечей как fallback
     candles = generate_candle_data(pair_id, timeframe, limit)
     print(f'📊 [get_chart_data] Generated {len(candles)} simulated candles for pair {pair_id}')
-    return jsonify(candles)
+    return jsonify(candles), 200, headers
 
 @api.route('/server-time', methods=['GET'])
 def get_server_time():
@@ -563,44 +691,27 @@ def get_current_pair_price(pair_id):
 
 @api.route('/prices', methods=['GET'])
 def get_all_prices():
-    """Получить текущие цены для всех активных пар"""
+    """Получить текущие цены для всех активных пар (или только для pair_ids=1,2,3)"""
+    pair_ids = request.args.get('pair_ids')
+    if pair_ids:
+        try:
+            pair_ids = [int(pair_id) for pair_id in pair_ids.split(',') if pair_id.strip()]
+        except ValueError:
+            return jsonify({'error': 'pair_ids must be a comma-separated list of integers'}), 400
+    else:
+        pair_ids = None
+    
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, symbol FROM trading_pairs WHERE active = 1')
-        pairs = cursor.fetchall()
-        conn.close()
-        
-        prices = {}
-        for pair_id, symbol in pairs:
-            try:
-                price = get_current_price(pair_id)
-                prices[pair_id] = {
-                    'symbol': symbol,
-                    'price': price,
-                    'timestamp': datetime.utcnow().timestamp()
-                }
-            except Exception as e:
-                print(f'Error getting price for pair {pair_id} ({symbol}): {e}')
-                continue
-        
-        return jsonify(prices)
+        return jsonify(get_active_pair_prices(pair_ids))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api.route('/win-rate', methods=['GET'])
 @api.route('/admin/win-rate', methods=['GET'])
+@versioned(get_settings_version, 'settings')
 def get_win_rate():
-    """Получить процент выигрыша"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT value FROM settings WHERE key = ?', ('win_rate',))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return jsonify({'win_rate': int(row[0])})
-    return jsonify({'win_rate': 50})
+    """Получить процент выигрыша (из кэша настроек, с ETag по версии настроек)"""
+    return jsonify({'win_rate': int(get_setting('win_rate', 50))})
 
 import os
 from flask import send_from_directory
@@ -610,8 +721,9 @@ IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'im
 
 @api.route('/img/<path:filename>', methods=['GET'])
 def get_image(filename):
-    """Отдаём картинку из backend/static/img"""
-    return send_from_directory(IMG_DIR, filename)
+    """Отдаём картинку из backend/static/img (из памяти, если она есть в assets)"""
+    from assets import serve_asset
+    return serve_asset(f'img/{filename}') or send_from_directory(IMG_DIR, filename)
 
 @api.route('/admin/win-rate', methods=['POST'])
 def set_win_rate():
@@ -629,65 +741,138 @@ def set_win_rate():
     except (ValueError, TypeError):
         return jsonify({'error': 'win_rate must be a number'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)
-    ''', ('win_rate', str(win_rate)))
-    conn.commit()
-    conn.close()
+    # Пишем в БД и атомарно обновляем кэш (новая версия инвалидирует ETag у клиентов)
+    set_setting('win_rate', win_rate)
     
     return jsonify({'win_rate': win_rate})
 
+@api.route('/admin/market-data', methods=['GET'])
+def get_market_data_stats():
+    """Задержки и ошибки запросов к бирже по эндпоинтам"""
+    from market_data import get_metrics
+    return jsonify(get_metrics())
+
+@api.route('/admin/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """Статистика пула соединений с БД"""
+    from models import get_pool_stats
+    return jsonify(get_pool_stats())
+
+@api.route('/admin/ledger', methods=['GET'])
+def get_ledger_stats():
+    """Состояние журнала баланса: последняя запись и последняя перенесенная в БД"""
+    return jsonify(account_ledger.get_stats())
+
+@api.route('/admin/subscriptions', methods=['GET'])
+def get_subscription_stats():
+    """Количество подписчиков Socket.IO по парам (цены) и по (пара, таймфрейм) (живые свечи)"""
+    from subscriptions import subscriber_counts
+    prices = subscriber_counts('prices')
+    candles = subscriber_counts('candles')
+    return jsonify({
+        'prices': {str(pair_id): count for (_, pair_id), count in prices.items()},
+        'candles': {f'{pair_id}:{timeframe}': count for (_, pair_id, timeframe), count in candles.items()}
+    })
+
 @api.route('/accounts', methods=['GET'])
+@cached('private, no-cache')
 def get_accounts():
     """Получить список аккаунтов пользователя (demo и real)"""
     user_id = request.args.get('user_id', 1, type=int)
-    from models import get_or_create_accounts
-    accounts = get_or_create_accounts(user_id)
-    return jsonify(accounts)
+    accounts = account_ledger.get_user_accounts(user_id)
+    return jsonify([{'id': a['id'], 'account_type': a['account_type'], 'balance': a['balance']} for a in accounts])
 
-@api.route('/accounts/current', methods=['GET'])
-def get_current_account():
-    """Получить текущий активный аккаунт (из сессии или по умолчанию demo)"""
+def summarize_stats(rounds, wins, volume, pnl):
+    """Итоги по набору раундов для /accounts/<id>/stats"""
+    return {
+        'rounds': rounds,
+        'wins': wins,
+        'losses': rounds - wins,
+        'win_rate': round(wins * 100 / rounds, 2) if rounds else 0.0,
+        'volume': round(volume, 2),
+        'pnl': round(pnl, 2)
+    }
+
+@api.route('/accounts/<int:account_id>/stats', methods=['GET'])
+@cached('private, no-cache')
+def get_account_stats(account_id):
+    """Статистика аккаунта: итоги, по парам и по дням (?from=YYYY-MM-DD&to=YYYY-MM-DD, UTC, включительно).
+    
+    Читается из сводной таблицы account_daily_stats (обновляется при завершении раундов),
+    поэтому стоит O(дней x пар), а не O(раундов).
+    """
     user_id = request.args.get('user_id', 1, type=int)
-    account_id = request.args.get('account_id', type=int)
+    day_from = request.args.get('from')
+    day_to = request.args.get('to')
+    try:
+        for day in (day_from, day_to):
+            if day:
+                datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'from and to must be dates in YYYY-MM-DD format'}), 400
+    
+    if not find_account(user_id, account_id):
+        return jsonify({'error': 'Account not found'}), 404
+    
+    query = 'SELECT day, pair_id, rounds, wins, volume, pnl FROM account_daily_stats WHERE account_id = ?'
+    params = [account_id]
+    if day_from:
+        query += ' AND day >= ?'
+        params.append(day_from)
+    if day_to:
+        query += ' AND day <= ?'
+        params.append(day_to)
     
     conn = get_db()
     cursor = conn.cursor()
-    
-    if account_id:
-        # Если передан account_id, возвращаем его
-        cursor.execute('''
-            SELECT id, user_id, account_type, balance 
-            FROM accounts 
-            WHERE id = ? AND user_id = ?
-        ''', (account_id, user_id))
-    else:
-        # Иначе возвращаем demo аккаунт по умолчанию
-        cursor.execute('''
-            SELECT id, user_id, account_type, balance 
-            FROM accounts 
-            WHERE user_id = ? AND account_type = 'demo'
-            LIMIT 1
-        ''', (user_id,))
-    
-    row = cursor.fetchone()
+    cursor.execute(query + ' ORDER BY day', params)
+    rows = cursor.fetchall()
     conn.close()
     
-    if row:
-        return jsonify({
-            'id': row[0],
-            'user_id': row[1],
-            'account_type': row[2],
-            'balance': row[3]
+    totals = [0, 0, 0.0, 0.0]
+    by_pair = {}
+    by_day = {}
+    for day, pair_id, rounds, wins, volume, pnl in rows:
+        for bucket in (totals, by_pair.setdefault(pair_id, [0, 0, 0.0, 0.0]), by_day.setdefault(day, [0, 0, 0.0, 0.0])):
+            bucket[0] += rounds
+            bucket[1] += wins
+            bucket[2] += volume
+            bucket[3] += pnl
+    
+    pairs = []
+    for pair_id, values in sorted(by_pair.items()):
+        pair = get_pair(pair_id)
+        pairs.append({
+            'pair_id': pair_id,
+            'symbol': pair['symbol'] if pair else None,
+            'name': pair['name'] if pair else None,
+            **summarize_stats(*values)
         })
     
+    return jsonify({
+        'account_id': account_id,
+        'from': day_from,
+        'to': day_to,
+        'totals': summarize_stats(*totals),
+        'by_pair': pairs,
+        'by_day': [{'day': day, **summarize_stats(*values)} for day, values in by_day.items()]
+    })
+
+@api.route('/accounts/current', methods=['GET'])
+def get_current_account():
+    """Получить текущий активный аккаунт (из сессии или по умолчанию demo)"""
+    user_id = request.args.get('user_id', 1, type=int)
+    account_id = request.args.get('account_id', type=int)
+    
+    # Если передан account_id, возвращаем его, иначе demo аккаунт по умолчанию
+    account = find_account(user_id, account_id)
+    if account:
+        return jsonify(account)
+    
     # Если аккаунт не найден, создаем его
-    from models import get_or_create_accounts
-    accounts = get_or_create_accounts(user_id)
+    accounts = account_ledger.get_user_accounts(user_id)
     demo_account = next((a for a in accounts if a['account_type'] == 'demo'), accounts[0])
-    return jsonify(demo_account)
+    return jsonify({'id': demo_account['id'], 'account_type': demo_account['account_type'], 'balance': demo_account['balance']})
 
 @api.route('/accounts/switch', methods=['POST'])
 def switch_account():
@@ -700,33 +885,9 @@ def switch_account():
     if not account_id and not account_type:
         return jsonify({'error': 'account_id or account_type is required'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    if account_id:
-        cursor.execute('''
-            SELECT id, user_id, account_type, balance 
-            FROM accounts 
-            WHERE id = ? AND user_id = ?
-        ''', (account_id, user_id))
-    else:
-        cursor.execute('''
-            SELECT id, user_id, account_type, balance 
-            FROM accounts 
-            WHERE user_id = ? AND account_type = ?
-            LIMIT 1
-        ''', (user_id, account_type))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return jsonify({
-            'id': row[0],
-            'user_id': row[1],
-            'account_type': row[2],
-            'balance': row[3]
-        })
+    account = find_account(user_id, account_id, account_type)
+    if account:
+        return jsonify(account)
     
     return jsonify({'error': 'Account not found'}), 404
 
@@ -737,25 +898,13 @@ def get_admin_balance():
     account_type = request.args.get('account_type')  # 'demo' или 'real'
     user_id = request.args.get('user_id', 1, type=int)
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    if account_id:
-        cursor.execute('SELECT id, account_type, balance FROM accounts WHERE id = ? AND user_id = ?', (account_id, user_id))
-    elif account_type:
-        cursor.execute('SELECT id, account_type, balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, account_type))
-    else:
-        # По умолчанию возвращаем demo аккаунт
-        cursor.execute('SELECT id, account_type, balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, 'demo'))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
+    # По умолчанию возвращаем demo аккаунт
+    account = find_account(user_id, account_id, account_type or 'demo')
+    if account:
         return jsonify({
-            'account_id': row[0],
-            'account_type': row[1],
-            'balance': row[2]
+            'account_id': account['id'],
+            'account_type': account['account_type'],
+            'balance': account['balance']
         })
     return jsonify({'error': 'Account not found'}), 404
 
@@ -763,12 +912,8 @@ def get_admin_balance():
 def get_admin_accounts():
     """Получить список всех аккаунтов с балансами для админки"""
     user_id = request.args.get('user_id', 1, type=int)
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, account_type, balance FROM accounts WHERE user_id = ? ORDER BY account_type', (user_id,))
-    accounts = [{'id': row[0], 'account_type': row[1], 'balance': row[2]} for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(accounts)
+    accounts = sorted(account_ledger.get_user_accounts(user_id, create=False), key=lambda a: a['account_type'])
+    return jsonify([{'id': a['id'], 'account_type': a['account_type'], 'balance': a['balance']} for a in accounts])
 
 @api.route('/admin/balance', methods=['POST'])
 def set_admin_balance():
@@ -794,40 +939,20 @@ def set_admin_balance():
     except (ValueError, TypeError):
         return jsonify({'error': 'balance must be a number'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
     # Определяем account_id
-    if account_id:
-        cursor.execute('SELECT id FROM accounts WHERE id = ? AND user_id = ?', (account_id, user_id))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({'error': 'Account not found'}), 404
-        target_account_id = account_id
-    elif account_type:
-        cursor.execute('SELECT id FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, account_type))
-        account = cursor.fetchone()
-        if not account:
-            conn.close()
-            return jsonify({'error': 'Account not found'}), 404
-        target_account_id = account[0]
-    else:
-        conn.close()
+    if not account_id and not account_type:
         return jsonify({'error': 'account_id or account_type is required'}), 400
+    account = find_account(user_id, account_id, account_type)
+    if not account:
+        return jsonify({'error': 'Account not found'}), 404
     
     # Обновляем баланс аккаунта
-    cursor.execute('UPDATE accounts SET balance = ? WHERE id = ?', (balance, target_account_id))
-    conn.commit()
-    
-    # Получаем обновленный баланс
-    cursor.execute('SELECT id, account_type, balance FROM accounts WHERE id = ?', (target_account_id,))
-    updated = cursor.fetchone()
-    conn.close()
+    new_balance = account_ledger.set_balance(account['id'], balance, 'admin_set')
     
     return jsonify({
-        'account_id': updated[0],
-        'account_type': updated[1],
-        'balance': updated[2]
+        'account_id': account['id'],
+        'account_type': account['account_type'],
+        'balance': new_balance
     })
 
 @api.route('/admin/balance/topup', methods=['POST'])
@@ -854,147 +979,68 @@ def topup_balance():
     except (ValueError, TypeError):
         return jsonify({'error': 'amount must be a number'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
     # Определяем account_id
-    if account_id:
-        cursor.execute('SELECT id, balance FROM accounts WHERE id = ? AND user_id = ?', (account_id, user_id))
-        account = cursor.fetchone()
-        if not account:
-            conn.close()
-            return jsonify({'error': 'Account not found'}), 404
-        target_account_id = account_id
-        current_balance = account[1]
-    elif account_type:
-        cursor.execute('SELECT id, balance FROM accounts WHERE user_id = ? AND account_type = ?', (user_id, account_type))
-        account = cursor.fetchone()
-        if not account:
-            conn.close()
-            return jsonify({'error': 'Account not found'}), 404
-        target_account_id = account[0]
-        current_balance = account[1]
-    else:
-        conn.close()
+    if not account_id and not account_type:
         return jsonify({'error': 'account_id or account_type is required'}), 400
-    
-    new_balance = current_balance + amount
+    account = find_account(user_id, account_id, account_type)
+    if not account:
+        return jsonify({'error': 'Account not found'}), 404
     
     # Обновляем баланс аккаунта
-    cursor.execute('UPDATE accounts SET balance = balance + ? WHERE id = ?', (amount, target_account_id))
-    conn.commit()
-    
-    # Получаем обновленный баланс для подтверждения
-    cursor.execute('SELECT id, account_type, balance FROM accounts WHERE id = ?', (target_account_id,))
-    updated = cursor.fetchone()
-    conn.close()
+    new_balance = account_ledger.credit(account['id'], amount, 'admin_topup')
     
     return jsonify({
-        'account_id': updated[0],
-        'account_type': updated[1],
-        'balance': updated[2],
+        'account_id': account['id'],
+        'account_type': account['account_type'],
+        'balance': new_balance,
         'added': amount,
-        'previous_balance': current_balance
+        'previous_balance': new_balance - amount
     })
 
 from utils import get_current_price
 
 def get_real_chart_data(pair_id, timeframe, limit):
-    """Получить реальные данные с Binance API"""
-    # Получаем символ пары из базы данных
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT symbol FROM trading_pairs WHERE id = ?', (pair_id,))
-    row = cursor.fetchone()
-    conn.close()
+    """Получить реальные свечи из локального хранилища (догружая новые с Binance)"""
+    import time
+    from candle_aggregator import parse_timeframe
+    from candle_store import sync_candles, get_candles, max_chart_limit
     
-    if not row:
+    # Символ пары - из реестра пар в памяти
+    symbol = get_symbol(pair_id)
+    if symbol is None:
         return None
     
-    symbol = row[0]
-    
     # Проверяем, что это USDT пара (Binance формат)
     if not symbol.endswith('USDT'):
         return None
     
-    # Маппинг таймфреймов на интервалы Binance
-    timeframe_map = {
-        '1m': '1m',
-        '5m': '5m',
-        '15m': '15m',
-        '1h': '1h'
-    }
-    
-    interval = timeframe_map.get(timeframe, '1m')
+    # Любой поддерживаемый таймфрейм (1m, 5m, 4h, 1d...) выводится из 1m ряда
+    interval = parse_timeframe(timeframe)
+    if interval is None:
+        return None
+    limit = min(limit, max_chart_limit(interval))
     
     try:
-        # Запрос к Binance API
-        url = 'https://api.binance.com/api/v3/klines'
-        params = {
-            'symbol': symbol,
-            'interval': interval,
-            'limit': min(limit, 1000)  # Binance ограничивает до 1000
-        }
-        
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Конвертируем данные Binance в наш формат
-        candles = []
-        for candle in data:
-            candles.append({
-                'time': int(candle[0] / 1000),  # Binance возвращает в миллисекундах
-                'open': float(candle[1]),
-                'high': float(candle[2]),
-                'low': float(candle[3]),
-                'close': float(candle[4])
-            })
-        
-        return candles
+        # Догружаем только 1m свечи новее последней сохраненной (не чаще CANDLE_SYNC_INTERVAL)
+        # и, если нужно, недостающую историю назад
+        sync_candles(symbol, since=int(time.time()) - interval * limit)
     except Exception as e:
-        print(f'Error fetching data from Binance: {e}')
-        return None
+        # Binance недоступен - отдаем то, что уже есть в хранилище
+        print(f'Error syncing candles from Binance: {e}')
+    
+    return get_candles(symbol, timeframe, limit) or None
 
 def generate_candle_data(pair_id, timeframe, limit):
-    """Генерировать данные свечей для графика"""
+    """Генерировать данные свечей для графика (детерминированно: одна и та же история для пары и времени)"""
     import time
-    from datetime import timedelta
-    from utils import get_current_price
-    
-    # Определяем интервал в секундах
-    timeframe_seconds = {
-        '1m': 60,
-        '5m': 300,
-        '15m': 900,
-        '1h': 3600
-    }
-    interval = timeframe_seconds.get(timeframe, 60)
+    from candle_aggregator import parse_timeframe
+    from candle_simulator import generate_candles
     
-    base_price = get_current_price(pair_id)
-    candles = []
+    # Определяем интервал в секундах (таймфрейм проверен в get_chart_data)
+    interval = parse_timeframe(timeframe)
+    if interval is None:
+        return []
     
-    # Генерируем исторические данные
-    now = datetime.utcnow()
-    for i in range(limit - 1, -1, -1):
-        timestamp = now - timedelta(seconds=interval * i)
-        
-        # Генерируем случайное движение цены
-        change = random.uniform(-0.002, 0.002)  # ±0.2%
-        open_price = base_price * (1 + change)
-        close_price = open_price * (1 + random.uniform(-0.001, 0.001))
-        high_price = max(open_price, close_price) * (1 + random.uniform(0, 0.001))
-        low_price = min(open_price, close_price) * (1 - random.uniform(0, 0.001))
-        
-        candles.append({
-            'time': int(timestamp.timestamp()),
-            'open': round(open_price, 5),
-            'high': round(high_price, 5),
-            'low': round(low_price, 5),
-            'close': round(close_price, 5)
-        })
-        
-        base_price = close_price
+    symbol = get_symbol(pair_id) or f'PAIR{pair_id}'
     
-    return candles
-
+    return generate_candles(symbol, interval, min(limit, 1000), int(time.time()))
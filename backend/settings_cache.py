@@ -0,0 +1,55 @@
+import threading
+import time
+
+from models import get_db
+
+# Снимок таблицы settings в памяти: заменяется целиком, поэтому чтение не требует блокировки
+_settings = None
+# Версия снимка: стартует от времени загрузки (в мс), чтобы не повторяться после рестарта,
+# и увеличивается при каждом изменении
+_version = 0
+_lock = threading.Lock()
+
+def load_settings():
+    """Загрузить все настройки из БД в кэш (при старте приложения)"""
+    global _settings, _version
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT key, value FROM settings')
+    settings = {row[0]: row[1] for row in cursor.fetchall()}
+    conn.close()
+
+    with _lock:
+        _settings = settings
+        _version = max(_version + 1, int(time.time() * 1000))
+    return settings
+
+def get_setting(key, default=None):
+    """Получить значение настройки из кэша"""
+    settings = _settings if _settings is not None else load_settings()
+    return settings.get(key, default)
+
+def get_settings_version():
+    """Текущая версия настроек (для ETag)"""
+    if _settings is None:
+        load_settings()
+    return _version
+
+def set_setting(key, value):
+    """Сохранить настройку в БД и атомарно обновить кэш"""
+    global _settings, _version
+    if _settings is None:
+        load_settings()
+    value = str(value)
+    with _lock:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+        conn.commit()
+        conn.close()
+
+        settings = dict(_settings or {})
+        settings[key] = value
+        _settings = settings
+        _version += 1
+    return _version
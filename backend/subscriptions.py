@@ -0,0 +1,70 @@
+import threading
+
+# Учет подписок клиентов. Ключ подписки - кортеж, например ('candles', pair_id, '1m').
+# Свечи рассылаются в комнату Socket.IO (имя строится из ключа), кадры цен ('prices', pair_id) -
+# напрямую по sid подписчиков, сгруппированных по набору пар
+_subscribers = {}  # key -> set(sid)
+_sid_keys = {}  # sid -> set(key)
+_lock = threading.Lock()
+
+def room_name(key):
+    """Имя Socket.IO комнаты для ключа подписки"""
+    return ':'.join(str(part) for part in key)
+
+def subscribe(sid, key):
+    """Отметить подписку клиента; True, если это новая подписка"""
+    with _lock:
+        sids = _subscribers.setdefault(key, set())
+        if sid in sids:
+            return False
+        sids.add(sid)
+        _sid_keys.setdefault(sid, set()).add(key)
+        return True
+
+def unsubscribe(sid, key):
+    """Снять подписку клиента; True, если она была"""
+    with _lock:
+        sids = _subscribers.get(key)
+        if not sids or sid not in sids:
+            return False
+        sids.discard(sid)
+        if not sids:
+            del _subscribers[key]
+        keys = _sid_keys.get(sid)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del _sid_keys[sid]
+        return True
+
+def unsubscribe_all(sid):
+    """Снять все подписки отключившегося клиента"""
+    with _lock:
+        keys = _sid_keys.pop(sid, set())
+        for key in keys:
+            sids = _subscribers.get(key)
+            if sids:
+                sids.discard(sid)
+                if not sids:
+                    del _subscribers[key]
+    return keys
+
+def active_keys(kind):
+    """Ключи вида kind, на которые есть хотя бы один подписчик"""
+    with _lock:
+        return [key for key in _subscribers if key[0] == kind]
+
+def subscriber_counts(kind):
+    """Количество подписчиков по ключам вида kind"""
+    with _lock:
+        return {key: len(sids) for key, sids in _subscribers.items() if key[0] == kind}
+
+def subscribers_by_sid(kind):
+    """Ключи вида kind по клиентам: sid -> [key]"""
+    with _lock:
+        result = {}
+        for sid, keys in _sid_keys.items():
+            selected = [key for key in keys if key[0] == kind]
+            if selected:
+                result[sid] = selected
+        return result
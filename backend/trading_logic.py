@@ -1,18 +1,13 @@
 from models import get_db
-from datetime import datetime
+import account_ledger
+import time
+from datetime import datetime, timezone
 import random
 
 def get_win_rate():
-    """Получить процент выигрыша из настроек"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT value FROM settings WHERE key = ?', ('win_rate',))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return int(row[0])
-    return 50  # По умолчанию 50%
+    """Получить процент выигрыша из настроек (кэш в памяти)"""
+    from settings_cache import get_setting
+    return int(get_setting('win_rate', 50))  # По умолчанию 50%
 
 def determine_round_result(win_rate):
     """Определить результат раунда на основе процента выигрыша"""
@@ -23,87 +18,122 @@ def determine_round_result(win_rate):
     random_value = random.randint(1, 100)
     return random_value <= win_rate
 
+def determine_round_results(win_rate, count):
+    """Определить результаты сразу для пачки раундов (один проход генератора)"""
+    randrange = random.randrange
+    return [randrange(100) < win_rate for _ in range(count)]
+
 def calculate_profit(amount, win_rate_percent):
     """Рассчитать прибыль при выигрыше"""
     # Процент прибыли 85% как в Lynx
     profit_percent = 0.85
     return amount * profit_percent
 
+def user_room(user_id):
+    """Имя Socket.IO комнаты пользователя (в нее приходят результаты его раундов)"""
+    return f'user_{user_id}'
+
+def stats_day(end_time):
+    """День (UTC, 'YYYY-MM-DD') для сводной статистики по end_time раунда в миллисекундах"""
+    return datetime.fromtimestamp(end_time / 1000, timezone.utc).date().isoformat()
+
+def record_round_stats(cursor, results):
+    """Добавить завершенные раунды в сводную статистику (в транзакции завершения).
+    
+    results - (account_id, end_time, pair_id, win, amount, profit); строки одного
+    (аккаунт, день, пара) складываются заранее, в таблицу идет одна запись на ключ.
+    """
+    totals = {}
+    for account_id, end_time, pair_id, win, amount, profit in results:
+        key = (account_id, stats_day(end_time), pair_id)
+        rounds, wins, volume, pnl = totals.get(key, (0, 0, 0.0, 0.0))
+        totals[key] = (rounds + 1, wins + (1 if win else 0), volume + amount, pnl + profit)
+    cursor.executemany('''
+        INSERT INTO account_daily_stats (account_id, day, pair_id, rounds, wins, volume, pnl)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (account_id, day, pair_id) DO UPDATE SET
+            rounds = rounds + excluded.rounds,
+            wins = wins + excluded.wins,
+            volume = volume + excluded.volume,
+            pnl = pnl + excluded.pnl
+    ''', [key + values for key, values in totals.items()])
+
 def check_and_finish_rounds(socketio, app=None):
-    """Проверить и завершить истекшие раунды"""
+    """Проверить и завершить истекшие раунды (одной пачкой)"""
     from app import app as flask_app
+    from utils import get_current_price
     app = app or flask_app
     
     conn = get_db()
     cursor = conn.cursor()
     
     # Находим активные раунды, которые должны быть завершены
-    now = datetime.utcnow()
+    now = int(time.time() * 1000)  # end_time в БД - миллисекунды Unix
     cursor.execute('''
-        SELECT r.id, r.user_id, r.pair_id, r.direction, r.amount, 
-               r.start_price, tp.symbol, tp.name
-        FROM rounds r
-        JOIN trading_pairs tp ON r.pair_id = tp.id
-        WHERE r.status = 'active' AND r.end_time <= ?
+        SELECT id, pair_id
+        FROM rounds
+        WHERE status = 'active' AND end_time <= ?
     ''', (now,))
+    due_rounds = cursor.fetchall()
     
-    finished_rounds = cursor.fetchall()
+    if not due_rounds:
+        conn.close()
+        return []
     
-    if finished_rounds:
-        print(f'🔄 [check_and_finish_rounds] Found {len(finished_rounds)} finished round(s)')
+    print(f'🔄 [check_and_finish_rounds] Found {len(due_rounds)} finished round(s)')
     
+    # Одна цена на каждую пару - до транзакции, чтобы не держать блокировку записи
+    end_prices = {pair_id: get_current_price(pair_id) for pair_id in {row[1] for row in due_rounds}}
     win_rate = get_win_rate()
     
-    for round_data in finished_rounds:
-        round_id = round_data[0]
-        user_id = round_data[1]
-        pair_id = round_data[2]
-        direction = round_data[3]
-        amount = round_data[4]
-        start_price = round_data[5]
-        symbol = round_data[6]
-        name = round_data[7]
-        
-        # Определяем результат
-        win = determine_round_result(win_rate)
-        
-        # Генерируем конечную цену (симулированная)
-        from utils import get_current_price
-        end_price = get_current_price(pair_id)
+    # Все изменения - одной транзакцией. BEGIN IMMEDIATE сразу берет блокировку записи,
+    # поэтому раунды, которые мы перечитываем ниже, уже никто не завершит параллельно
+    cursor.execute('BEGIN IMMEDIATE')
+    due_ids = [row[0] for row in due_rounds]
+    placeholders = ','.join('?' * len(due_ids))
+    cursor.execute(f'''
+        SELECT r.id, r.user_id, r.account_id, r.pair_id, r.direction, r.amount, 
+               r.start_price, tp.symbol, tp.name, r.end_time
+        FROM rounds r
+        LEFT JOIN trading_pairs tp ON r.pair_id = tp.id
+        WHERE r.id IN ({placeholders}) AND r.status = 'active'
+    ''', due_ids)
+    rounds = cursor.fetchall()
+    
+    # Старые раунды без account_id относим к demo аккаунту пользователя
+    demo_accounts = {}
+    for user_id in {row[1] for row in rounds if row[2] is None}:
+        demo_account = account_ledger.find_account(user_id)
+        if demo_account:
+            demo_accounts[user_id] = demo_account['id']
+    
+    # Результаты для всех раундов разом
+    wins = determine_round_results(win_rate, len(rounds))
+    
+    settled = []
+    payouts = []
+    end_times = {}
+    for round_data, win in zip(rounds, wins):
+        round_id, user_id, account_id, pair_id, direction, amount, start_price, symbol, name, end_time = round_data
+        end_times[round_id] = end_time
+        if account_id is None:
+            account_id = demo_accounts.get(user_id)
+            if account_id is None:
+                print(f'❌ [check_and_finish_rounds] Account not found for round {round_id}')
+                continue
         
         # Рассчитываем прибыль
         if win:
             profit = calculate_profit(amount, win_rate)
-            new_balance_change = amount + profit  # Возвращаем ставку + прибыль
+            # Возвращаем ставку + прибыль (при проигрыше ставка уже была списана)
+            payouts.append((account_id, amount + profit, round_id))
         else:
             profit = -amount  # Теряем всю ставку
-            new_balance_change = 0  # Ставка уже была списана
         
-        # Обновляем баланс пользователя
-        if win:
-            cursor.execute('UPDATE users SET balance = balance + ? WHERE id = ?', 
-                         (new_balance_change, user_id))
-        
-        # Сохраняем результат
-        cursor.execute('''
-            INSERT INTO round_results (round_id, win, profit, end_price)
-            VALUES (?, ?, ?, ?)
-        ''', (round_id, win, profit, end_price))
-        
-        # Обновляем статус раунда
-        cursor.execute('UPDATE rounds SET status = ? WHERE id = ?', 
-                      ('finished', round_id))
-        
-        # Получаем новый баланс
-        cursor.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
-        new_balance = cursor.fetchone()[0]
-        
-        conn.commit()
-        
-        # Подготавливаем данные для отправки
-        round_finished_data = {
+        settled.append({
             'round_id': round_id,
             'user_id': user_id,
+            'account_id': account_id,
             'pair_id': pair_id,
             'win': win,
             'profit': profit,
@@ -112,16 +142,63 @@ def check_and_finish_rounds(socketio, app=None):
             'symbol': symbol,
             'name': name,
             'start_price': start_price,
-            'end_price': end_price,
-            'new_balance': new_balance
-        }
-        
-        print(f'📤 [check_and_finish_rounds] Emitting round_finished for round {round_id}:', round_finished_data)
-        
-        # Отправляем событие через WebSocket с правильным контекстом
-        with app.app_context():
-            socketio.emit('round_finished', round_finished_data, room=None)
-            print(f'✅ [check_and_finish_rounds] Event emitted for round {round_id}')
+            'end_price': end_prices.get(pair_id, start_price)
+        })
     
-    conn.close()
-
+    cursor.executemany(
+        "UPDATE rounds SET status = 'finished', account_id = ? WHERE id = ?",
+        [(r['account_id'], r['round_id']) for r in settled]
+    )
+    cursor.executemany(
+        'INSERT INTO round_results (round_id, win, profit, end_price) VALUES (?, ?, ?, ?)',
+        [(r['round_id'], r['win'], r['profit'], r['end_price']) for r in settled]
+    )
+    
+    # Счетчики завершенных раундов для истории
+    finished_counts = {}
+    for r in settled:
+        finished_counts[r['account_id']] = finished_counts.get(r['account_id'], 0) + 1
+    cursor.executemany(
+        'UPDATE accounts SET finished_rounds = finished_rounds + ? WHERE id = ?',
+        [(count, account_id) for account_id, count in finished_counts.items()]
+    )
+    record_round_stats(cursor, [
+        (r['account_id'], end_times[r['round_id']], r['pair_id'], r['win'], r['amount'], r['profit'])
+        for r in settled
+    ])
+    
+    # Выигрыши пишем в журнал баланса (по записи на раунд) до коммита. После сбоя между
+    # журналом и коммитом восстановление применит запись, только если раунд в БД завершен
+    with account_ledger.round_transaction():
+        try:
+            balances = account_ledger.credit_many(payouts, 'round_win') if payouts else {}
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        try:
+            conn.commit()
+        except Exception:
+            if payouts:
+                account_ledger.credit_many(
+                    [(account_id, -payout, round_id) for account_id, payout, round_id in payouts],
+                    'round_win_revert'
+                )
+            raise
+        finally:
+            conn.close()
+    
+    # Одно событие на пользователя со всеми его завершенными раундами
+    by_user = {}
+    for r in settled:
+        r['new_balance'] = balances.get(r['account_id'])
+        if r['new_balance'] is None:
+            r['new_balance'] = account_ledger.get_balance(r['account_id'])
+        by_user.setdefault(r['user_id'], []).append(r)
+    
+    with app.app_context():
+        for user_id, user_rounds in by_user.items():
+            socketio.emit('rounds_finished', {'user_id': user_id, 'rounds': user_rounds}, room=user_room(user_id))
+    
+    print(f'📤 [check_and_finish_rounds] Settled {len(settled)} round(s) for {len(by_user)} user(s)')
+    return settled
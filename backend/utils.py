@@ -1,68 +1,157 @@
-import random
+import json
+import os
+import threading
+import time
 import requests
 
-def get_current_price(pair_id):
-    """Получить текущую цену пары с Binance API"""
-    from models import get_db
-    
-    # Получаем символ пары из базы данных
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT symbol FROM trading_pairs WHERE id = ?', (pair_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if not row:
-        # Fallback на симуляцию
-        return 100.0 + random.uniform(-1, 1)
-    
-    symbol = row[0]
-    
-    # Проверяем, что это USDT пара (Binance формат)
-    # Если не USDT пара, используем симуляцию без запроса к Binance
+import market_data
+import price_model
+
+# Сколько секунд снимок цены считается свежим (после этого идем к Binance)
+PRICE_MAX_AGE = float(os.environ.get('PRICE_MAX_AGE', '3'))
+
+# Как часто фоновая задача обновляет снимок цен (секунды)
+PRICE_REFRESH_INTERVAL = float(os.environ.get('PRICE_REFRESH_INTERVAL', '1'))
+
+# Сколько секунд готовый ответ /api/prices переиспользуется между запросами
+PRICES_RESULT_TTL = float(os.environ.get('PRICES_RESULT_TTL', '1'))
+
+# Общий для процесса снимок цен: symbol -> (price, timestamp)
+_price_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+# Общий результат для всех активных пар: pair_id -> {symbol, price, timestamp}
+_all_prices_result = {'timestamp': 0.0, 'prices': None}
+_all_prices_lock = threading.Lock()
+
+def simulate_price(symbol):
+    """Модельная цена (без Binance): продолжает движение от последней реальной цены"""
+    return price_model.next_price(symbol)
+
+def store_prices(prices, timestamp=None):
+    """Записать цены {symbol: price} в общий снимок"""
+    timestamp = timestamp or time.time()
+    with _snapshots_lock:
+        for symbol, price in prices.items():
+            _price_snapshots[symbol] = (price, timestamp)
+    for symbol, price in prices.items():
+        price_model.observe(symbol, price, timestamp)
+
+def get_price_snapshot(symbol, max_age=None):
+    """Получить цену из снимка или None, если ее нет или она устарела"""
+    snapshot = _price_snapshots.get(symbol)
+    if snapshot is None:
+        return None
+    price, timestamp = snapshot
+    if time.time() - timestamp > (PRICE_MAX_AGE if max_age is None else max_age):
+        return None
+    return price
+
+def active_usdt_symbols():
+    """Символы активных USDT пар (только их цены читаются из снимка)"""
+    from pair_registry import get_active_pairs
+    return [pair['symbol'] for pair in get_active_pairs() if pair['symbol'].endswith('USDT')]
+
+def fetch_active_ticker_prices():
+    """Загрузить цены активных USDT пар одним запросом к Binance и обновить снимок"""
+    symbols = active_usdt_symbols()
+    if not symbols:
+        return {}
+    try:
+        items = market_data.get_json('ticker/price', {'symbols': json.dumps(symbols, separators=(',', ':'))})
+    except requests.exceptions.HTTPError as e:
+        # Binance отклоняет весь запрос, если хоть один символ ему неизвестен - берем полный список
+        if e.response is None or e.response.status_code != 400:
+            raise
+        items = market_data.get_json('ticker/price')
+    wanted = set(symbols)
+    prices = {item['symbol']: float(item['price']) for item in items if item['symbol'] in wanted}
+    store_prices(prices)
+    return prices
+
+def refresh_price_snapshots():
+    """Фоновое обновление снимка цен (единственный регулярный источник)"""
+    try:
+        return fetch_active_ticker_prices()
+    except market_data.CircuitOpen:
+        return None
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        print(f'Error refreshing price snapshots from Binance: {e}')
+        return None
+
+def get_price_by_symbol(symbol):
+    """Получить цену по символу: сначала из снимка, при устаревании - с Binance"""
+    # Для не-USDT пар используем симуляцию без запроса к Binance
     if not symbol.endswith('USDT'):
-        # Для не-USDT пар используем симуляцию
-        base_prices = {
-            'BTCUSDT': 65000.0,
-            'ETHUSDT': 3500.0,
-            'BNBUSDT': 600.0,
-            'SOLUSDT': 150.0,
-            'ADAUSDT': 0.5
-        }
-        base = base_prices.get(symbol, 100.0)
-        return base + random.uniform(-base * 0.001, base * 0.001)
-    
-    # Для USDT пар пытаемся получить реальную цену с Binance
+        return simulate_price(symbol)
+
+    price = get_price_snapshot(symbol)
+    if price is not None:
+        return price
+
+    # Снимок устарел (фоновая задача не успела или не запущена) - идем к Binance.
+    # Если Binance недоступен (circuit open), get_json сразу поднимает CircuitOpen без ожидания
     try:
-        url = 'https://api.binance.com/api/v3/ticker/price'
-        params = {'symbol': symbol}
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        price = float(data['price'])
+        price = float(market_data.get_json('ticker/price', {'symbol': symbol})['price'])
+        store_prices({symbol: price})
         return price
+    except market_data.CircuitOpen:
+        pass
     except requests.exceptions.RequestException as e:
         print(f'Error fetching real price for {symbol} from Binance: {e}')
-        # Fallback на симуляцию только если Binance недоступен
-        base_prices = {
-            'BTCUSDT': 65000.0,
-            'ETHUSDT': 3500.0,
-            'BNBUSDT': 600.0,
-            'SOLUSDT': 150.0,
-            'ADAUSDT': 0.5
-        }
-        base = base_prices.get(symbol, 100.0)
-        return base + random.uniform(-base * 0.001, base * 0.001)
     except (KeyError, ValueError) as e:
         print(f'Error parsing price for {symbol}: {e}')
-        # Fallback на симуляцию
-        base_prices = {
-            'BTCUSDT': 65000.0,
-            'ETHUSDT': 3500.0,
-            'BNBUSDT': 600.0,
-            'SOLUSDT': 150.0,
-            'ADAUSDT': 0.5
+
+    # Fallback на модель только если Binance недоступен
+    return simulate_price(symbol)
+
+def get_current_price(pair_id):
+    """Получить текущую цену пары (из общего снимка цен)"""
+    from pair_registry import get_symbol
+
+    # Символ пары - из реестра пар в памяти
+    symbol = get_symbol(pair_id)
+    if symbol is None:
+        # Fallback на модель
+        return simulate_price(f'PAIR{pair_id}')
+
+    return get_price_by_symbol(symbol)
+
+def _build_all_prices():
+    """Собрать цены всех активных пар (не более одного запроса к Binance)"""
+    from pair_registry import get_active_pairs
+
+    pairs = [(pair['id'], pair['symbol']) for pair in get_active_pairs()]
+
+    # Если хотя бы одной USDT пары нет в свежем снимке - обновляем весь снимок одним запросом
+    usdt_symbols = [symbol for _, symbol in pairs if symbol.endswith('USDT')]
+    if any(get_price_snapshot(symbol) is None for symbol in usdt_symbols):
+        refresh_price_snapshots()
+
+    timestamp = time.time()
+    prices = {}
+    for pair_id, symbol in pairs:
+        price = get_price_snapshot(symbol) if symbol.endswith('USDT') else None
+        prices[pair_id] = {
+            'symbol': symbol,
+            'price': price if price is not None else simulate_price(symbol),
+            'timestamp': timestamp
         }
-        base = base_prices.get(symbol, 100.0)
-        return base + random.uniform(-base * 0.001, base * 0.001)
+    return prices
+
+def get_active_pair_prices(pair_ids=None):
+    """Цены всех активных пар; результат разделяется между одновременными запросами"""
+    result = _all_prices_result
+    if result['prices'] is None or time.time() - result['timestamp'] > PRICES_RESULT_TTL:
+        with _all_prices_lock:
+            # Повторная проверка: пока ждали блокировку, результат мог собрать другой запрос
+            result = _all_prices_result
+            if result['prices'] is None or time.time() - result['timestamp'] > PRICES_RESULT_TTL:
+                prices = _build_all_prices()
+                result = {'timestamp': time.time(), 'prices': prices}
+                _all_prices_result.update(result)
 
+    prices = result['prices']
+    if pair_ids is None:
+        return dict(prices)
+    return {pair_id: prices[pair_id] for pair_id in pair_ids if pair_id in prices}
@@ -1,11 +1,18 @@
 from app import socketio, app
-from models import get_db
-from trading_logic import check_and_finish_rounds
+import os
 from datetime import datetime
+import time
+import live_candles
+import price_frames
+import subscriptions
 
 # Глобальный список подключенных клиентов (в этом модуле)
 connected_clients = set()
 
+# Рассылать server_time всем клиентам каждую секунду. Клиенты синхронизируют часы через
+# time_sync и считают время сами, поэтому по умолчанию рассылка выключена
+SERVER_TIME_BROADCAST = os.environ.get('SERVER_TIME_BROADCAST', '0') == '1'
+
 
 def emit_server_time():
     """Отправка серверного времени каждую секунду"""
@@ -32,71 +39,126 @@ def emit_server_time():
             traceback.print_exc()
             socketio.sleep(1)
 
+def refresh_prices_periodically():
+    """Единственный регулярный источник общего снимка цен"""
+    from utils import refresh_price_snapshots, PRICE_REFRESH_INTERVAL
+    
+    while True:
+        try:
+            refresh_price_snapshots()
+        except Exception as e:
+            print(f'Error in price refresh loop: {e}')
+        socketio.sleep(PRICE_REFRESH_INTERVAL)
+
+def probe_upstream_periodically():
+    """Пока биржа недоступна (circuit open), проверяет ее в фоне, не задерживая запросы"""
+    import market_data
+    
+    while True:
+        socketio.sleep(market_data.CIRCUIT_RESET_TIMEOUT)
+        try:
+            if market_data.circuit_state() != 'closed':
+                market_data.probe()
+        except Exception as e:
+            print(f'Error in upstream probe loop: {e}')
+
+def flush_ledger_periodically():
+    """Переносит измененные балансы из журнала в SQLite пачками"""
+    import account_ledger
+    
+    while True:
+        socketio.sleep(account_ledger.LEDGER_FLUSH_INTERVAL)
+        try:
+            account_ledger.flush()
+        except Exception as e:
+            print(f'Error in ledger flush loop: {e}')
+
+def emit_candle_updates(pair_id, symbol, timeframes, price, timestamp):
+    """Обновить текущие свечи пары и разослать изменения подписчикам"""
+    for timeframe in timeframes:
+        closed, current = live_candles.on_price(pair_id, symbol, timeframe, price, timestamp)
+        room = subscriptions.room_name(('candles', pair_id, timeframe))
+        if closed is not None:
+            socketio.emit('candle_closed', {'pair_id': pair_id, 'timeframe': timeframe, 'candle': closed}, room=room)
+        if current is not None:
+            socketio.emit('candle_update', {'pair_id': pair_id, 'timeframe': timeframe, 'candle': current}, room=room)
+
+def emit_price_batches(price_subscribers, prices, full, timestamp):
+    """Разослать кадр prices_batch: клиенты с одинаковым набором пар получают один общий кадр"""
+    groups = {}
+    for sid, keys in price_subscribers.items():
+        pair_ids = frozenset(pair_id for _, pair_id in keys if pair_id in prices)
+        if pair_ids:
+            groups.setdefault(pair_ids, []).append(sid)
+    if not groups:
+        return 0
+    
+    seq = price_frames.next_seq()
+    for pair_ids, sids in groups.items():
+        frame = price_frames.build_frame(seq, {pair_id: prices[pair_id] for pair_id in pair_ids}, full, timestamp)
+        # Список комнат-sid: пакет кодируется один раз на группу
+        socketio.emit('prices_batch', frame, to=sids)
+    return len(groups)
+
 def emit_price_updates():
-    """Отправка обновлений цен каждые несколько секунд"""
-    from utils import get_current_price
-    from models import get_db
-    import requests
+    """Рассылка цен кадрами prices_batch (только изменения, периодически - полный снимок)"""
+    from utils import get_price_by_symbol
+    from pair_registry import get_active_pairs
     
     socketio.sleep(2)  # Небольшая задержка перед началом
+    last_snapshot = 0.0
     
     while True:
         try:
-            socketio.sleep(2)  # Обновляем каждые 2 секунды для более плавного обновления
+            socketio.sleep(price_frames.PRICE_BATCH_INTERVAL)
+            
+            # Подписчики цен по клиентам и пары, у которых есть подписчики на цену или на живую свечу
+            price_subscribers = subscriptions.subscribers_by_sid('prices')
+            price_pairs = {pair_id for keys in price_subscribers.values() for _, pair_id in keys}
+            # Таймфреймы живых свечей, на которые подписаны клиенты: pair_id -> [timeframe]
+            candle_timeframes = {}
+            for _, pair_id, timeframe in subscriptions.active_keys('candles'):
+                candle_timeframes.setdefault(pair_id, []).append(timeframe)
+            
+            # Свечи и цены, на которые больше никто не подписан, не держим
+            subscribed = {(pair_id, timeframe) for pair_id, timeframes in candle_timeframes.items() for timeframe in timeframes}
+            live_candles.discard([key for key in live_candles.tracked_keys() if key not in subscribed])
+            price_frames.forget([pair_id for pair_id in price_frames.tracked_pairs() if pair_id not in price_pairs])
+            
+            if not price_pairs and not candle_timeframes:
+                continue
             
             # КРИТИЧНО: Используем app.app_context() для правильного контекста Flask
             with app.app_context():
-                # Получаем все активные пары
-                conn = get_db()
-                cursor = conn.cursor()
-                cursor.execute('SELECT id, symbol FROM trading_pairs WHERE active = 1')
-                pairs = cursor.fetchall()
-                conn.close()
+                # Активные пары - из реестра в памяти
+                pairs = [(pair['id'], pair['symbol']) for pair in get_active_pairs()]
                 
-                if not pairs:
-                    continue
-                
-                # Получаем цены для всех пар одним запросом к Binance
-                usdt_pairs = [p[1] for p in pairs if p[1].endswith('USDT')]
-                
-                if usdt_pairs:
+                # Цены берем из общего снимка (его обновляет refresh_prices_periodically)
+                now = time.time()
+                prices = {}
+                for pair_id, symbol in pairs:
+                    if pair_id not in price_pairs and pair_id not in candle_timeframes:
+                        continue
                     try:
-                        # Получаем цены для всех пар одним запросом
-                        url = 'https://api.binance.com/api/v3/ticker/price'
-                        response = requests.get(url, timeout=5)
-                        response.raise_for_status()
-                        all_prices = {item['symbol']: float(item['price']) for item in response.json()}
+                        price = get_price_by_symbol(symbol)
+                        if pair_id in price_pairs:
+                            prices[pair_id] = (symbol, price)
+                        emit_candle_updates(pair_id, symbol, candle_timeframes.get(pair_id, ()), price, now)
                         
-                        # Отправляем обновления для каждой пары
-                        for pair_id, symbol in pairs:
-                            try:
-                                if symbol in all_prices:
-                                    price = all_prices[symbol]
-                                else:
-                                    price = get_current_price(pair_id)
-                                
-                                socketio.emit('price_update', {
-                                    'pair_id': pair_id,
-                                    'price': price,
-                                    'timestamp': datetime.utcnow().timestamp()
-                                })
-                                
-                            except Exception as e:
-                                print(f'Error emitting price for pair {pair_id}: {e}')
                     except Exception as e:
-                        print(f'Error fetching prices from Binance: {e}')
-                        # Fallback на индивидуальные запросы
-                        for pair_id, symbol in pairs:
-                            try:
-                                price = get_current_price(pair_id)
-                                socketio.emit('price_update', {
-                                    'pair_id': pair_id,
-                                    'price': price,
-                                    'timestamp': datetime.utcnow().timestamp()
-                                })
-                                
-                            except Exception as e:
-                                print(f'Error emitting price for pair {pair_id}: {e}')
+                        print(f'Error emitting price for pair {pair_id}: {e}')
+                
+                if not prices:
+                    continue
+                
+                full = now - last_snapshot >= price_frames.PRICE_SNAPSHOT_INTERVAL
+                if full:
+                    snapshot = {pair_id: price for pair_id, (_, price) in prices.items()}
+                    price_frames.mark_sent(snapshot)
+                    emit_price_batches(price_subscribers, snapshot, True, now)
+                    last_snapshot = now
+                else:
+                    emit_price_batches(price_subscribers, price_frames.changed_prices(prices), False, now)
                     
         except Exception as e:
             print(f'Error in price update loop: {e}')
@@ -104,29 +166,23 @@ def emit_price_updates():
             traceback.print_exc()
             socketio.sleep(5)
 
-# Функция check_rounds_periodically отключена - теперь раунды завершаются на клиенте
-# def check_rounds_periodically():
-#     """Периодическая проверка и завершение раундов"""
-#     while True:
-#         try:
-#             with app.app_context():
-#                 check_and_finish_rounds(socketio, app)
-#             socketio.sleep(1)  # Проверяем каждую секунду
-#         except Exception as e:
-#             print(f'❌ Error checking rounds: {e}')
-#             import traceback
-#             traceback.print_exc()
-#             socketio.sleep(1)
-
 def start_background_tasks():
     """Запуск фоновых задач используя socketio.start_background_task"""
     try:
         # Используем socketio.start_background_task для правильной работы с Flask-SocketIO
-        print('🔄 Starting emit_server_time task...')
-        socketio.start_background_task(emit_server_time)
-        # check_rounds_periodically отключен - раунды завершаются на клиенте
-        # print('🔄 Starting check_rounds_periodically task...')
-        # socketio.start_background_task(check_rounds_periodically)
+        if SERVER_TIME_BROADCAST:
+            print('🔄 Starting emit_server_time task...')
+            socketio.start_background_task(emit_server_time)
+        # Раунды завершает сервер: планировщик спит до ближайшего end_time
+        print('🔄 Starting run_round_scheduler task...')
+        from round_scheduler import run_round_scheduler
+        socketio.start_background_task(run_round_scheduler)
+        print('🔄 Starting refresh_prices_periodically task...')
+        socketio.start_background_task(refresh_prices_periodically)
+        print('🔄 Starting probe_upstream_periodically task...')
+        socketio.start_background_task(probe_upstream_periodically)
+        print('🔄 Starting flush_ledger_periodically task...')
+        socketio.start_background_task(flush_ledger_periodically)
         print('🔄 Starting emit_price_updates task...')
         socketio.start_background_task(emit_price_updates)
         print('✅ All background tasks started using socketio.start_background_task')
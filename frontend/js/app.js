@@ -56,6 +56,13 @@ let tradeDuration = 60; // секунды
 // Хранение времени сервера (UTC) в секундах (Unix timestamp)
 let serverTimeUTC = null;
 
+// Синхронизация часов с сервером по сокету (как в NTP):
+// offsetMs - сколько прибавить к Date.now(), чтобы получить время сервера
+const CLOCK_SYNC_SAMPLES = 5;
+const CLOCK_RESYNC_SAMPLES = 3;
+const CLOCK_RESYNC_INTERVAL = 5 * 60 * 1000; // повторная синхронизация от дрейфа часов
+let clockSync = { offsetMs: null, rttMs: null, syncing: false, resyncTimer: null, tickTimer: null };
+
 // Инициализация
 document.addEventListener('DOMContentLoaded', () => {
     // Ждем загрузки LightweightCharts библиотеки
@@ -78,8 +85,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 loadActiveRounds();
             }, 500);
             
-            // Запускаем HTTP polling для server time
-            startServerTimePolling();
+            // Время сервера: локальные часы со смещением из time_sync; HTTP polling - только если включен
+            startServerClock();
+            if (window.SERVER_TIME_POLLING) {
+                startServerTimePolling();
+            }
             
             // Запускаем глобальный таймер для обновления времени до полной минуты
             startGlobalTimeRemainingTimer();
@@ -93,6 +103,36 @@ document.addEventListener('DOMContentLoaded', () => {
 
 // initTradingView удалена - теперь используется chartModule
 
+// Подписки на живые свечи сервера: pairId -> timeframe.
+// Используется chart.js (startPriceUpdates/updateChart); после переподключения подписки восстанавливаются
+window.liveCandles = {
+    subscriptions: new Map(),
+    
+    subscribe(pairId, timeframe) {
+        const previous = this.subscriptions.get(pairId);
+        if (previous === timeframe) {
+            return;
+        }
+        this.subscriptions.set(pairId, timeframe);
+        if (socket && socket.connected) {
+            if (previous) {
+                socket.emit('unsubscribe_candles', { pair_id: pairId, timeframe: previous });
+            }
+            socket.emit('subscribe_candles', { pair_id: pairId, timeframe: timeframe });
+        }
+    },
+    
+    resubscribe() {
+        this.subscriptions.forEach((timeframe, pairId) => {
+            socket.emit('subscribe_candles', { pair_id: pairId, timeframe: timeframe });
+        });
+    },
+    
+    isActive(pairId) {
+        return !!(socket && socket.connected && this.subscriptions.has(pairId));
+    },
+};
+
 function initSocket() {
     // Используем SOCKET_URL из config.js, если доступен, иначе window.location.origin
     const socketUrl = window.SOCKET_URL || window.location.origin;
@@ -123,6 +163,8 @@ function initSocket() {
         
         socket.emit('subscribe_rounds', { user_id: 1 });
         console.log('✅ Sent subscribe_rounds event');
+        window.liveCandles.resubscribe();
+        syncServerClock(CLOCK_SYNC_SAMPLES);
         
         // // Тестовая отправка - проверим, работает ли вообще WebSocket
         // setTimeout(() => {
@@ -156,6 +198,11 @@ function initSocket() {
             window.serverTimeLogCount++;
         }
         
+        // После синхронизации часов время считается локально, рассылка нужна только до нее
+        if (clockSync.offsetMs !== null) {
+            return;
+        }
+        
         // Обработка, если data - это массив (socket.io иногда оборачивает)
         let actualData = data;
         if (Array.isArray(data) && data.length > 0) {
@@ -193,15 +240,25 @@ function initSocket() {
         }
     });
     
-    // Обработчик round_finished удален - теперь используем клиентскую логику finishRoundOnClient
-    // socket.on('round_finished', (data) => {
-    //     handleRoundFinished(data);
-    // });
+    // Раунды завершает сервер по end_time (см. window.SERVER_SETTLEMENT в config.js).
+    // Все раунды пользователя, истекшие одновременно, приходят одним событием
+    socket.on('rounds_finished', (data) => {
+        (data.rounds || []).forEach(round => handleRoundFinished(round));
+    });
     
     socket.on('round_update', (data) => {
         updateRoundTime(data);
     });
     
+    // Текущая свеча строится на сервере: приходят только изменения подписанных графиков
+    socket.on('candle_update', (data) => {
+        window.chartModule.applyLiveCandle(data.pair_id, data.timeframe, data.candle);
+    });
+    
+    socket.on('candle_closed', (data) => {
+        window.chartModule.applyLiveCandle(data.pair_id, data.timeframe, data.candle);
+    });
+    
     // WebSocket price_update больше не используется - используем HTTP polling
 }
 
@@ -2105,11 +2162,21 @@ async function loadHistory(page = 1) {
             window.API_BASE = window.location.origin + '/api';
         }
         
+        // Первая страница - сбрасываем курсоры (история могла пополниться)
+        if (page === 1) {
+            historyCursors = [null];
+        }
+        
         // Пытаемся получить историю с сервера
         let url = `${window.API_BASE}/rounds/history?user_id=1&page=${page}`;
         if (currentAccountId) {
             url += `&account_id=${currentAccountId}`;
         }
+        // Курсор страницы (next_cursor предыдущей): сервер продолжает с этой позиции без OFFSET
+        const historyCursor = historyCursors[page - 1];
+        if (historyCursor) {
+            url += `&cursor=${encodeURIComponent(historyCursor)}`;
+        }
         console.log('📜 Fetching history from:', url);
         
         try {
@@ -2118,6 +2185,7 @@ async function loadHistory(page = 1) {
                 const data = await response.json();
                 // Обрабатываем ответ от сервера
                 if (data.transactions && Array.isArray(data.transactions)) {
+                    historyCursors[page] = data.next_cursor || null;
                     displayHistory(data.transactions);
                     // Обновляем кнопки пагинации
                     updateHistoryPagination(data.page, data.total_pages);
@@ -2237,6 +2305,8 @@ function getSymbolIcon(symbol) {
 }
 
 let currentHistoryPage = 1;
+// historyCursors[i] - курсор страницы i + 1 (для первой страницы курсор не нужен)
+let historyCursors = [null];
 
 function updateHistoryPagination(currentPage, totalPages) {
     currentHistoryPage = currentPage;
@@ -2604,7 +2674,76 @@ function updateServerTime(timeStr) {
     });
 }
 
-// HTTP Polling для server time (надежный способ вместо WebSocket)
+// Один замер: t0/t3 - отправка/получение на клиенте, t1/t2 - получение/ответ на сервере (мс)
+function requestClockSample() {
+    return new Promise((resolve) => {
+        const t0 = Date.now();
+        const timeout = setTimeout(() => resolve(null), 5000);
+        socket.emit('time_sync', { t0: t0 }, (data) => {
+            clearTimeout(timeout);
+            const t3 = Date.now();
+            if (!data || typeof data.t1 !== 'number' || typeof data.t2 !== 'number') {
+                resolve(null);
+                return;
+            }
+            resolve({
+                rtt: (t3 - t0) - (data.t2 - data.t1),
+                offset: ((data.t1 - t0) + (data.t2 - t3)) / 2,
+            });
+        });
+    });
+}
+
+// Синхронизация часов: несколько замеров подряд, берем смещение замера с минимальной задержкой
+async function syncServerClock(samples) {
+    if (!socket || !socket.connected || clockSync.syncing) {
+        return;
+    }
+    clockSync.syncing = true;
+    try {
+        let best = null;
+        for (let i = 0; i < samples; i++) {
+            const sample = await requestClockSample();
+            if (sample && sample.rtt >= 0 && (!best || sample.rtt < best.rtt)) {
+                best = sample;
+            }
+        }
+        if (best) {
+            clockSync.offsetMs = best.offset;
+            clockSync.rttMs = best.rtt;
+            tickServerClock();
+            console.log(`🕐 [clock sync] offset=${Math.round(best.offset)}ms, rtt=${best.rtt}ms`);
+        }
+    } catch (error) {
+        console.error('❌ Error syncing server clock:', error);
+    } finally {
+        clockSync.syncing = false;
+    }
+}
+
+function tickServerClock() {
+    if (clockSync.offsetMs === null) {
+        return;
+    }
+    serverTimeUTC = Math.floor((Date.now() + clockSync.offsetMs) / 1000);
+    updateServerTime();
+}
+
+// Локальные часы сервера: обновление раз в секунду без запросов и периодическая ресинхронизация
+function startServerClock() {
+    if (clockSync.tickTimer) {
+        clearInterval(clockSync.tickTimer);
+    }
+    if (clockSync.resyncTimer) {
+        clearInterval(clockSync.resyncTimer);
+    }
+    clockSync.tickTimer = setInterval(tickServerClock, 1000);
+    clockSync.resyncTimer = setInterval(() => syncServerClock(CLOCK_RESYNC_SAMPLES), CLOCK_RESYNC_INTERVAL);
+    // Сокет мог подключиться раньше - тогда синхронизируемся сразу
+    syncServerClock(CLOCK_SYNC_SAMPLES);
+}
+
+// HTTP Polling для server time (старая схема, включается window.SERVER_TIME_POLLING)
 function startServerTimePolling() {
     const pollServerTime = async () => {
         try {
@@ -2647,14 +2786,19 @@ function startServerTimePolling() {
 
 // Экспортируем функцию для получения времени сервера (UTC-3)
 window.getServerTimeUTC = function() {
+    const UTC_OFFSET_HOURS = 3;
+    const UTC_OFFSET_SECONDS = UTC_OFFSET_HOURS * 3600;
+    
+    // После синхронизации часов время сервера считаем локально по смещению
+    if (clockSync.offsetMs !== null) {
+        return Math.floor((Date.now() + clockSync.offsetMs) / 1000) - UTC_OFFSET_SECONDS;
+    }
+    
     // Сервер всегда возвращает время, поэтому просто возвращаем serverTimeUTC минус 3 часа
     if (serverTimeUTC === null || serverTimeUTC === undefined) {
         return null; // Возвращаем null, если серверное время еще не получено
     }
     
-    const UTC_OFFSET_HOURS = 3;
-    const UTC_OFFSET_SECONDS = UTC_OFFSET_HOURS * 3600;
-    
     // Возвращаем серверное время (UTC) минус 3 часа для UTC-3
     return serverTimeUTC - UTC_OFFSET_SECONDS;
 };
@@ -3122,6 +3266,18 @@ function calculateProfit(amount, isWin) {
 }
 
 async function finishRoundOnClient(round) {
+    if (window.SERVER_SETTLEMENT) {
+        // Раунд завершит сервер и пришлет rounds_finished; если событие потерялось
+        // (например, при переподключении), сверяемся с сервером через несколько секунд
+        setTimeout(() => {
+            if (activeRounds.some(r => r.id === round.id)) {
+                loadActiveRounds();
+                loadBalance();
+            }
+        }, 5000);
+        return;
+    }
+    
     console.log(`🏁 [finishRoundOnClient] Finishing round ${round.id} on client`);
     
     // #region agent log
@@ -3268,7 +3424,11 @@ function handleRoundFinished(data) {
     
     // Получаем pair_id из данных или из активных раундов
     const finishedRound = activeRounds.find(r => r.id === data.round_id);
-    const pairId = finishedRound ? finishedRound.pair_id : (data.pair_id || null);
+    if (!finishedRound) {
+        // Раунд другого пользователя/аккаунта или уже обработанный
+        return;
+    }
+    const pairId = finishedRound.pair_id || data.pair_id || null;
     
     // Удаляем линию и прямоугольник с графика СРАЗУ
     if (window.chartModule && window.chartModule.removeOrderLine && pairId) {
@@ -3295,7 +3455,10 @@ function handleRoundFinished(data) {
         profit: data.profit,
         win: data.win
     });
-    if (data.new_balance !== undefined && data.new_balance !== null) {
+    if (data.account_id && currentAccountId && data.account_id !== currentAccountId) {
+        // Баланс относится к другому аккаунту - перечитываем текущий
+        loadBalance();
+    } else if (data.new_balance !== undefined && data.new_balance !== null) {
         userBalance = data.new_balance;
         updateBalanceDisplay();
         updateMobileV2Balance();
@@ -1069,7 +1069,15 @@ function startPriceUpdates(pairId) {
         clearInterval(priceUpdateIntervals.get(pairId));
     }
     
+    // Живые свечи приходят по сокету (candle_update); опрос /price - только fallback без сокета
+    if (window.liveCandles) {
+        window.liveCandles.subscribe(pairId, currentTimeframe);
+    }
+    
     const interval = setInterval(async () => {
+        if (window.liveCandles && window.liveCandles.isActive(pairId)) {
+            return;
+        }
         try {
             const url = `${window.API_BASE}/price/${pairId}`;
             const response = await fetch(url);
@@ -1358,6 +1366,57 @@ function animateCandleUpdate(pairId, chartData, lastCandle, targetBar, updateTim
     candleAnimations.set(pairId, { frameId, targetPrice, startPrice, startTime });
 }
 
+// Применение свечи, построенной сервером (candle_update / candle_closed)
+function applyLiveCandle(pairId, timeframe, candle) {
+    const chartData = charts.get(pairId);
+    if (!chartData || !chartData.candlestickSeries || !candle) {
+        return;
+    }
+    // Пока грузится другой таймфрейм, чужие свечи не применяем
+    if (timeframe !== currentTimeframe) {
+        return;
+    }
+    
+    // Свечи сервера в UTC, график в UTC-3 (как в loadChartData)
+    const UTC_OFFSET_SECONDS = 3 * 3600;
+    const bar = {
+        time: Number(candle.time) - UTC_OFFSET_SECONDS,
+        open: parseFloat(candle.open),
+        high: parseFloat(candle.high),
+        low: parseFloat(candle.low),
+        close: parseFloat(candle.close),
+    };
+    if (isNaN(bar.time) || isNaN(bar.open) || isNaN(bar.close)) {
+        return;
+    }
+    
+    const cache = chartDataCache.get(pairId) || [];
+    const last = cache.length > 0 ? cache[cache.length - 1] : null;
+    // Lightweight Charts не принимает update() для свечи старше последней
+    if (last && bar.time < last.time) {
+        return;
+    }
+    
+    // Серверная свеча точнее анимации - останавливаем ее
+    if (candleAnimations.has(pairId)) {
+        const anim = candleAnimations.get(pairId);
+        if (anim.frameId) {
+            cancelAnimationFrame(anim.frameId);
+        }
+        candleAnimations.delete(pairId);
+    }
+    
+    if (last && bar.time === last.time) {
+        cache[cache.length - 1] = bar;
+    } else {
+        cache.push(bar);
+    }
+    chartDataCache.set(pairId, cache);
+    chartData.candlestickSeries.update(bar);
+    lastCandleTime.set(pairId, bar.time);
+    currentCandleData.set(pairId, {...bar});
+}
+
 function updateChart(pairId, timeframe) {
     currentPairId = pairId;
     currentTimeframe = timeframe;
@@ -1373,6 +1432,9 @@ function updateChart(pairId, timeframe) {
         candleAnimations.delete(pairId);
     }
     
+    if (window.liveCandles) {
+        window.liveCandles.subscribe(pairId, timeframe);
+    }
     loadChartData(pairId, timeframe);
 }
 
@@ -1721,6 +1783,7 @@ window.chartModule = {
     updateChart,
     loadChartData,
     updateLastCandle,
+    applyLiveCandle,
     drawOrderLine,
     removeOrderLine,
     updateOrderLineColor,
@@ -20,6 +20,14 @@
     window.API_BASE = `${PRODUCTION_URL}/api`;
     window.SOCKET_URL = PRODUCTION_URL;
     
+    // Раунды завершает сервер (событие rounds_finished по WebSocket).
+    // false - вернуть старую схему, когда клиент сам отправляет POST /rounds/<id>/finish
+    window.SERVER_SETTLEMENT = true;
+    
+    // Время сервера считается локально по смещению, измеренному через сокет (time_sync).
+    // true - дополнительно опрашивать /api/server-time каждую секунду (старая схема)
+    window.SERVER_TIME_POLLING = false;
+    
     // Если нужно использовать локальный сервер для разработки, раскомментируйте:
     // window.API_BASE = isProduction ? `${PRODUCTION_URL}/api` : `${window.location.origin}/api`;
     // window.SOCKET_URL = isProduction ? PRODUCTION_URL : window.location.origin;